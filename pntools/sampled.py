@@ -2,11 +2,349 @@
 Tools for working with sampled data
 """
 
+import atexit
 import collections
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from fractions import Fraction
 import numpy as np
-from scipy.signal import hilbert, firwin, filtfilt, butter, resample
-from scipy.fft import fft, fftfreq
+from scipy.signal import firwin, filtfilt, butter, resample, resample_poly, sosfilt, sosfiltfilt, lfilter, get_window
+from scipy.signal.windows import dpss
+from scipy import fft as sp_fft
+from scipy.fft import fft, fftfreq, next_fast_len
 from scipy.interpolate import interp1d
+from scipy import ndimage
+
+class FilterDesignCache:
+    """
+    Least-recently-used cache of filter designs shared by all sampled.Data objects.
+    Designs are keyed on their parameters, so the design cost is paid
+    once per parameter set instead of once per call. IIR filters are
+    returned as second-order sections by default. Callers receive
+    copies, so the cached designs can't be modified by accident.
+
+    Example:
+        sos = sampled.filter_cache.butter(6, 10., 180., 'low')
+        sampled.filter_cache.info() # {'hits': 0, 'misses': 1, 'size': 1, 'maxsize': 128}
+        sampled.filter_cache.maxsize = 512
+        sampled.filter_cache.clear()
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._designs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, design_func):
+        with self._lock:
+            if key in self._designs:
+                self.hits += 1
+                self._designs.move_to_end(key)
+                coeffs = self._designs[key]
+            else:
+                coeffs = None
+                self.misses += 1
+        if coeffs is None:
+            coeffs = design_func()
+            with self._lock:
+                self._designs[key] = coeffs
+                while len(self._designs) > self.maxsize:
+                    self._designs.popitem(last=False)
+        if isinstance(coeffs, tuple):
+            return tuple(c.copy() for c in coeffs)
+        return coeffs.copy()
+
+    @staticmethod
+    def _key_cutoff(cutoff):
+        return tuple(float(c) for c in np.atleast_1d(cutoff))
+
+    def butter(self, order, cutoff, sr, btype, output='sos'):
+        """Butterworth filter. Returns sos if output is 'sos', and (b, a) if output is 'ba'."""
+        assert output in ('sos', 'ba')
+        key = ('butter', int(order), self._key_cutoff(cutoff), float(sr), btype, output)
+        return self._get(key, lambda: butter(order, np.asarray(cutoff)/(0.5*sr), btype=btype, analog=False, output=output))
+
+    def firwin(self, numtaps, cutoff, sr, pass_zero):
+        """FIR filter taps. These are used directly as the numerator (b) of the filter."""
+        key = ('firwin', int(numtaps), self._key_cutoff(cutoff), float(sr), pass_zero)
+        return self._get(key, lambda: firwin(numtaps, cutoff, fs=sr, pass_zero=pass_zero))
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._designs), 'maxsize': self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._designs.clear()
+            self.hits = 0
+            self.misses = 0
+
+filter_cache = FilterDesignCache()
+
+ArrayRef = collections.namedtuple('ArrayRef', ('shape', 'dtype', 'digest'))
+ArrayRef.__doc__ = "Stand-in for a large array in the history of a sampled.Data object. See ProvenanceStore."
+
+def array_digest(arr):
+    """Content hash of an array (including its shape and dtype) as a hex string."""
+    arr = np.asarray(arr)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((arr.shape, arr.dtype.str)).encode())
+    h.update(np.ascontiguousarray(arr).view(np.uint8).data if arr.size else b'')
+    return h.hexdigest()
+
+class ProvenanceStore:
+    """
+    Compact records of processing parameters shared by all sampled.Data objects.
+    History entries are (name, params) tuples. Before they are added to a
+    history, params are compacted so that the history doesn't keep large
+    objects alive:
+        arrays with more than max_inline elements (and Data objects) -> ArrayRef(shape, dtype, digest)
+        functions -> 'module.qualname'
+        Interval -> ('Interval', start, end, sr)
+    ArrayRefs are kept in one table keyed on the digest, so a reference
+    signal used in many pipelines is recorded once.
+
+    Example:
+        x = sampled.Data(np.random.randn(10000, 4), sr=100)
+        y = x.regress(x.apply(np.abs)) # the reference signal is not kept alive by y._history
+        y._history[-1] # ('Regressed with reference', ArrayRef(shape=(10000, 4), dtype='float64', digest='...'))
+        sampled.provenance.dumps(y._history) # JSON string
+    """
+    def __init__(self, max_inline=64):
+        self.max_inline = max_inline
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def compact(self, value):
+        if isinstance(value, Data):
+            value = value._sig
+        if isinstance(value, np.ndarray) and value.size > self.max_inline:
+            ref = ArrayRef(value.shape, value.dtype.str, array_digest(value))
+            with self._lock:
+                return self._refs.setdefault(ref.digest, ref)
+        if isinstance(value, Interval):
+            return ('Interval', value.start.time, value.end.time, value.sr)
+        if isinstance(value, dict):
+            return {k: self.compact(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)) and not isinstance(value, ArrayRef):
+            return type(value)(self.compact(v) for v in value)
+        if callable(value) and hasattr(value, '__qualname__'):
+            module = getattr(value, '__module__', None)
+            return value.__qualname__ if module is None else module + '.' + value.__qualname__
+        return value
+
+    def entry(self, name, params=None):
+        """History entry with compacted parameters."""
+        return (name, self.compact(params))
+
+    def lookup(self, digest):
+        return self._refs.get(digest)
+
+    def to_json(self, value):
+        """Convert a history (or any part of it) into JSON-serializable objects."""
+        if isinstance(value, ArrayRef):
+            return {'ArrayRef': {'shape': list(value.shape), 'dtype': value.dtype, 'digest': value.digest}}
+        if isinstance(value, dict):
+            return {str(k): self.to_json(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.to_json(v) for v in value]
+        if isinstance(value, slice):
+            return {'slice': [self.to_json(value.start), self.to_json(value.stop), self.to_json(value.step)]}
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        return repr(value)
+
+    def dumps(self, history, **kwargs):
+        """Serialize a history to a JSON string. kwargs are passed to json.dumps."""
+        return json.dumps(self.to_json(history), **kwargs)
+
+    def info(self):
+        return {'size': len(self._refs), 'max_inline': self.max_inline}
+
+    def clear(self):
+        with self._lock:
+            self._refs.clear()
+
+provenance = ProvenanceStore()
+
+class ResultCache:
+    """
+    Opt-in on-disk cache of the results of expensive sampled.Data operations
+    (detrend_airPLS, bandpass, medfilt, resample). Results are keyed on a
+    hash of the input samples, sampling rate, time axis, operation, and its
+    parameters, and stored as .npy files with the history entry in a JSON
+    sidecar. Hits are memory-mapped (read-only, copied on write). The least
+    recently used results are evicted when the cache grows beyond max_bytes.
+    Tuples in the parameters of a cached history entry come back as lists.
+
+    Example:
+        sampled.result_cache.enable('~/.cache/pntools', max_bytes=20e9)
+        y = x.detrend_airPLS() # computed and stored
+        y = x.detrend_airPLS() # loaded from disk
+        sampled.result_cache.info()
+        sampled.result_cache.disable()
+    """
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def enable(self, directory, max_bytes=10e9):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def disable(self):
+        self.directory = None
+
+    def key(self, data, name, params):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(array_digest(data._sig).encode()) # hashed on every call, since the samples can be modified in place
+        h.update(provenance.dumps([float(data.sr), int(data.axis), name, provenance.compact(params)], sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.directory, key+'.npy'), os.path.join(self.directory, key+'.json')
+
+    def load(self, key, data):
+        """Data object for a cached result computed from data, or None if it is not in the cache."""
+        npy_file, json_file = self._paths(key)
+        try:
+            with open(json_file, 'r') as f:
+                meta = json.load(f, object_hook=lambda d: ArrayRef(tuple(d['ArrayRef']['shape']), d['ArrayRef']['dtype'], d['ArrayRef']['digest']) if set(d) == {'ArrayRef'} else d)
+            sig = np.load(npy_file, mmap_mode='r')
+            os.utime(npy_file) # most recently used
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        ret = data.__class__(sig, meta['sr'], data.axis, data._history + [tuple(meta['history_entry'])], data._t0)
+        ret._cow = True
+        return ret
+
+    def save(self, key, result):
+        nbytes = result._sig.nbytes
+        if nbytes > self.max_bytes:
+            return
+        npy_file, json_file = self._paths(key)
+        tmp = os.path.join(self.directory, key + '.' + uuid.uuid4().hex + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, result._sig)
+        with open(tmp + '.json', 'w') as f:
+            f.write(provenance.dumps({'sr': float(result.sr), 'history_entry': result._history[-1]}))
+        os.replace(tmp + '.json', json_file)
+        os.replace(tmp, npy_file)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used results until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for fname in os.listdir(self.directory):
+                if fname.endswith('.npy'):
+                    st = os.stat(os.path.join(self.directory, fname))
+                    entries.append((st.st_mtime, st.st_size, fname[:-4]))
+            total = sum(e[1] for e in entries)
+            for _, size, key in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                for fname in self._paths(key):
+                    with contextlib.suppress(OSError):
+                        os.remove(fname)
+                total -= size
+
+    def info(self):
+        size = 0
+        if self.enabled:
+            size = sum(os.path.getsize(os.path.join(self.directory, f)) for f in os.listdir(self.directory) if f.endswith('.npy'))
+        return {'hits': self.hits, 'misses': self.misses, 'directory': self.directory, 'bytes': size, 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        if self.enabled:
+            for fname in os.listdir(self.directory):
+                if fname.endswith(('.npy', '.json')):
+                    os.remove(os.path.join(self.directory, fname))
+        self.hits = 0
+        self.misses = 0
+
+result_cache = ResultCache()
+
+def _has_callable(value):
+    """Callables are recorded by name in the history, so they can't be part of a cache key"""
+    if isinstance(value, dict):
+        return any(_has_callable(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_callable(v) for v in value)
+    return callable(value)
+
+def cached_result(method):
+    """Decorator for sampled.Data methods whose results can be stored in result_cache. Calls with callable parameters are not cached."""
+    signature = inspect.signature(method)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not result_cache.enabled:
+            return method(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = list(bound.arguments.items())[1:]
+        if _has_callable(params): # e.g. a lambda, or a callable window in resample
+            return method(self, *args, **kwargs)
+        key = result_cache.key(self, method.__name__, params)
+        ret = result_cache.load(key, self)
+        if ret is None:
+            ret = method(self, *args, **kwargs)
+            result_cache.save(key, ret)
+        return ret
+    return wrapper
+
+FFT_WORKERS = -1 # number of threads used by scipy.fft, -1 uses all cores
+FFT_PAD_FAST_LEN = False # zero-pad the analytic signal (envelope, phase, etc.) to a fast FFT length, see analytic_signal
+
+PARALLEL = {'n_workers': 1, 'backend': 'thread'} # per-channel execution, see parallel
+
+@contextlib.contextmanager
+def parallel(n_workers=None, backend='thread'):
+    """
+    Run per-channel computations in Data.get_trend_airPLS,
+    Data.detrend_airPLS, Data.interpnan and Data.apply in a pool of
+    workers. The result (and history) is the same as the serial path.
+        n_workers - None uses all cores
+        backend - 'thread' or 'process'. Process pools receive the signal
+            through shared memory, and the function must be picklable (no lambdas).
+    Functions given to Data.apply must process channels independently.
+    Example:
+        with sampled.parallel(8, 'process'):
+            trend = x.get_trend_airPLS()
+    """
+    assert backend in ('thread', 'process')
+    prev_config = dict(PARALLEL)
+    PARALLEL.update(n_workers=os.cpu_count() if n_workers is None else int(n_workers), backend=backend)
+    try:
+        yield
+    finally:
+        PARALLEL.update(prev_config)
+
 
 class Time:
     """
@@ -34,6 +372,8 @@ class Time:
         t.time
         t.sample
     """
+    __slots__ = ('_sr', '_sample', '_time')
+
     def __init__(self, inp, sr=30.):
         # set the sampling rate
         if isinstance(inp, tuple):
@@ -119,6 +459,166 @@ class Time:
         return "time={:.3f} s, sample={}, sr={} Hz ".format(self.time, self.sample, self.sr) + super().__repr__()
 
 
+class TimeArray:
+    """
+    Many time points at one sampling rate, stored as arrays of sample numbers and times.
+    Follows the conventions of Time, but conversions and arithmetic are
+    done on the whole array at once. INTEGERS IMPLY SAMPLE NUMBERS, FLOATS IMPLY TIME.
+        inp
+            (int array/list)    sample numbers
+            (float array/list)  times in seconds
+            (list of str)       timecodes hh;mm;ss;frame# (see from_timecode)
+            (list of Time)      sr is taken from the Time objects
+        sr
+            sampling rate, in Hz. casted into a float.
+    Examples:
+        t = TimeArray([9.32, 10.5, 11.25], 180)
+        t.sample, t.time
+        t.change_sr(2000.)  # time is held constant, sample numbers are updated
+        t + 10              # shift by 10 samples
+        t - 0.5             # shift by 0.5 s
+        t = TimeArray.from_timecode(['00;09;53;29', '00;10;00;02'], 29.97, drop_frame=True)
+        t.to_timecode(drop_frame=True)
+        t[0]                # sampled.Time
+    """
+    __slots__ = ('_sr', '_sample', '_time')
+
+    def __init__(self, inp, sr=30.):
+        time = None
+        if isinstance(inp, TimeArray):
+            inp, sr, time = inp.sample, inp.sr, inp.time.copy()
+        elif len(inp) > 0 and isinstance(inp[0], Time):
+            sr = inp[0].sr
+            assert all(t.sr == sr for t in inp)
+            inp, time = np.array([t.sample for t in inp], dtype=np.int64), np.array([t.time for t in inp])
+        elif len(inp) > 0 and isinstance(inp[0], str):
+            inp = self._parse_timecode(inp, float(sr), drop_frame=False)
+        self._sr = float(sr)
+        inp = np.asarray(inp)
+        if inp.dtype.kind == 'f': # time to sample
+            self._sample = (inp*self._sr).astype(np.int64)
+        else:
+            assert inp.dtype.kind in 'iu' or inp.size == 0
+            self._sample = inp.astype(np.int64)
+        # set the times based on the sample numbers
+        self._time = self._sample/self._sr if time is None else time
+
+    @classmethod
+    def from_timecode(cls, timecodes, sr=30., drop_frame=False):
+        """
+        Timecodes hh;mm;ss;frame# (or hh:mm:ss:frame#)
+        Drop-frame timecodes (e.g. 29.97 fps in Premiere Pro) skip frame numbers
+        at the start of every minute except every tenth minute.
+        """
+        return cls(cls._parse_timecode(timecodes, float(sr), drop_frame), sr)
+
+    @staticmethod
+    def _parse_timecode(timecodes, sr, drop_frame):
+        hh, mm, ss, ff = np.array([[int(x) for x in tc.replace(':', ';').split(';')] for tc in timecodes], dtype=np.int64).reshape(-1, 4).T
+        if not drop_frame:
+            return ((hh*60*60 + mm*60 + ss)*sr + ff).astype(np.int64) # same as Time
+        fps = int(round(sr))
+        n_drop = int(round(fps*0.066666)) # 2 for 29.97, 4 for 59.94
+        total_minutes = hh*60 + mm
+        return (total_minutes*60 + ss)*fps + ff - n_drop*(total_minutes - total_minutes//10)
+
+    def to_timecode(self, drop_frame=False):
+        """List of timecode strings. Drop-frame timecodes use ; and non-drop-frame timecodes use :"""
+        frames = self._sample
+        fps = int(round(self._sr))
+        if drop_frame:
+            n_drop = int(round(fps*0.066666))
+            frames_per_10min = fps*60*10 - n_drop*9
+            frames_per_min = fps*60 - n_drop
+            d, m = np.divmod(frames, frames_per_10min)
+            frames = frames + n_drop*9*d + n_drop*np.maximum(0, (m - n_drop)//frames_per_min)
+            sep = ';'
+        else:
+            sep = ':'
+        ff = frames % fps
+        ss = (frames // fps) % 60
+        mm = (frames // (fps*60)) % 60
+        hh = frames // (fps*60*60)
+        return [sep.join(f'{x:02d}' for x in hmsf) for hmsf in zip(hh.tolist(), mm.tolist(), ss.tolist(), ff.tolist())]
+
+    @property
+    def sr(self):
+        return self._sr
+
+    @sr.setter
+    def sr(self, sr_val):
+        """When changing the sampling rate, time is kept the same, and the sample numbers are NOT"""
+        self._sr = float(sr_val)
+        self._sample = (self._time*self._sr).astype(np.int64)
+
+    def change_sr(self, new_sr):
+        self.sr = new_sr
+        return self
+
+    @property
+    def sample(self):
+        return self._sample
+
+    @sample.setter
+    def sample(self, sample_val):
+        self._sample = np.asarray(sample_val).astype(np.int64)
+        self._time = self._sample/self._sr
+
+    @property
+    def time(self):
+        """Return times in seconds"""
+        return self._time
+
+    @time.setter
+    def time(self, s_val):
+        """If times are changed, then the sample numbers are reset as well"""
+        self._sample = (np.asarray(s_val, dtype=float)*self._sr).astype(np.int64)
+        self._time = self._sample/self._sr
+
+    def __len__(self):
+        return len(self._sample)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._to_time(self._sample[key], self._time[key])
+        ret = TimeArray(self._sample[key], self._sr)
+        ret._time = self._time[key]
+        return ret
+
+    def _to_time(self, sample, time):
+        ret = Time(int(sample), self._sr)
+        ret._time = float(time)
+        return ret
+
+    def __iter__(self):
+        for sample, time in zip(self._sample.tolist(), self._time.tolist()):
+            yield self._to_time(sample, time)
+
+    def to_list(self):
+        """List of sampled.Time objects"""
+        return list(self)
+
+    def __add__(self, other):
+        return self._arithmetic(other, np.add)
+
+    def __sub__(self, other):
+        return self._arithmetic(other, np.subtract)
+
+    def _arithmetic(self, other, op):
+        if isinstance(other, (TimeArray, Time)):
+            assert other.sr == self.sr
+            return TimeArray(op(self._sample, other.sample), self._sr)
+        other = np.asarray(other)
+        if other.dtype.kind in 'iu': # integer implies sample, float implies time
+            return TimeArray(op(self._sample, other), self._sr)
+        if other.dtype.kind == 'f':
+            return TimeArray(op(self.time, other), self._sr)
+        raise TypeError(other, "Unexpected input type! Input either floats for time, integers for samples, or a TimeArray")
+
+    def __repr__(self):
+        return "TimeArray(n={}, sr={} Hz)".format(len(self), self.sr)
+
+
 class Sequence:
     """
     Create a sequence of named time objects (collection).
@@ -256,10 +756,22 @@ class Interval:
 
     # iterator protocol - you can do: for sample, time, index in interval
     def __iter__(self):
-        """Iterate from start sample to end sample"""
-        return self
-    
+        """Iterate from start sample to end sample. Each loop gets its own iterator, so loops can be nested."""
+        return IntervalIterator(self)
+
+    def frames(self):
+        """
+        Arrays of (nearest_sample, time, index) for all animation frames at
+        iter_rate, the same values as iterating over the interval.
+        """
+        index_interval = 1./self.iter_rate
+        index = np.arange(int(self.dur_time*self.iter_rate)+2)
+        time = self.start.time + index*index_interval
+        nearest_sample = self.start.sample + (index*index_interval*self.sr).astype(int)
+        return nearest_sample, time, index
+
     def __next__(self):
+        """Kept for backward compatibility. Prefer iterating with a for loop, or frames."""
         index_interval = 1./self.iter_rate
         if self._index <= int(self.dur_time*self.iter_rate)+1:
             time = self.start.time + self._index*index_interval
@@ -288,10 +800,9 @@ class Interval:
         return self.t_data
         
     def _t(self, rate):
-        _t = [self.start.time]
-        while (this_t := _t[-1] + 1./rate) <= self.end.time:
-            _t.append(this_t)
-        return _t
+        """Times from start to end (inclusive) at rate"""
+        n = int(np.floor(self.dur_time*rate*(1 + 1e-12))) + 1 # tolerance to keep the end sample despite floating point error
+        return self.start.time + np.arange(n)/rate
 
     def __add__(self, other):
         """Used to shift an interval, use union to find a union"""
@@ -324,6 +835,100 @@ class Interval:
         return Interval(this_start, this_end, sr=self.sr, iter_rate=self.iter_rate)
 
 
+class IntervalIterator:
+    """Iterator over the (nearest_sample, time, index) frames of an Interval. See Interval.frames."""
+    def __init__(self, interval):
+        self._frames = zip(*(x.tolist() for x in interval.frames()))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._frames)
+
+
+class TimeAxis(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    Uniformly sampled time vector (t0 + k/sr for k in range(n)), computed on demand.
+    Indexing with an int returns a float, slicing returns another TimeAxis,
+    and the full array is only made when it is needed (e.g. np.asarray, plotting).
+    Arithmetic with arrays behaves like a numpy array, and adding or
+    subtracting a number shifts the time axis.
+    Example:
+        t = x.time_axis         # no allocation
+        t[0], t[-1], t[10:20]
+        t.searchsorted(2.5)     # same as np.searchsorted(np.asarray(t), 2.5)
+        np.asarray(t)
+    """
+    __slots__ = ('t0', 'sr', 'n')
+
+    def __init__(self, t0, sr, n):
+        self.t0 = t0
+        self.sr = sr
+        self.n = int(n)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def shape(self):
+        return (self.n,)
+
+    ndim = 1
+    dtype = np.dtype(float)
+
+    def __repr__(self):
+        return f'TimeAxis(t0={self.t0}, sr={self.sr}, n={self.n})'
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if not -self.n <= key < self.n:
+                raise IndexError(f'index {key} is out of bounds for a time axis of length {self.n}')
+            return self.t0 + (key % self.n)/self.sr
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.n)
+            if step > 0:
+                return TimeAxis(self.t0 + start/self.sr, self.sr/step, len(range(start, stop, step)))
+        return np.asarray(self)[key]
+
+    def __iter__(self):
+        for k in range(self.n):
+            yield self.t0 + k/self.sr
+
+    def __array__(self, dtype=None, copy=None):
+        return (self.t0 + np.arange(self.n)/self.sr).astype(dtype or float, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, TimeAxis) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __add__(self, other):
+        if isinstance(other, (int, float, np.integer, np.floating)):
+            return TimeAxis(self.t0 + other, self.sr, self.n)
+        return super().__add__(other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, (int, float, np.integer, np.floating)):
+            return TimeAxis(self.t0 - other, self.sr, self.n)
+        return super().__sub__(other)
+
+    def searchsorted(self, v, side='left'):
+        """Indices where v would be inserted to keep the time axis sorted (see np.searchsorted)."""
+        assert side in ('left', 'right')
+        v = np.asarray(v, dtype=float)
+        idx = np.clip(np.ceil((v - self.t0)*self.sr).astype(int), 0, self.n)
+        times = lambda k: self.t0 + k/self.sr
+        if side == 'left': # first index with t >= v
+            idx = np.where((idx > 0) & (times(idx-1) >= v), idx-1, idx)
+            idx = np.where((idx < self.n) & (times(idx) < v), idx+1, idx)
+        else: # first index with t > v
+            idx = np.where((idx < self.n) & (times(idx) <= v), idx+1, idx)
+            idx = np.where((idx > 0) & (times(idx-1) > v), idx-1, idx)
+        return idx if idx.ndim else int(idx)
+
+
 class Data: # Signal processing
     def __init__(self, sig, sr, axis=None, history=None, t0=0.):
         """
@@ -347,6 +952,29 @@ class Data: # Signal processing
             self._history = history
         self._t0 = t0
     
+    @classmethod
+    def from_file(cls, fname, sr, dtype=None, n_channels=None, axis=None, t0=0., offset=0):
+        """
+        Memory-map a signal stored on disk instead of reading it into memory.
+        Only the pages that are touched (e.g. by slicing) are read from disk.
+            fname - .npy file, or a raw binary file with interleaved channels
+            sr - sampling rate in Hz
+            dtype, n_channels - data type and number of channels of a raw binary file
+            offset - size of the header in bytes for raw binary files
+        Example:
+            x = sampled.Data.from_file('acq.bin', sr=2000, dtype=np.int16, n_channels=16)
+            x[3600.:3610.]() # reads only 10 s of data
+        """
+        if os.path.splitext(fname)[-1].lower() == '.npy':
+            sig = np.load(fname, mmap_mode='r')
+        else:
+            assert dtype is not None and n_channels is not None
+            dtype = np.dtype(dtype)
+            n_samples = (os.path.getsize(fname) - offset) // (dtype.itemsize*n_channels)
+            shape = (n_samples,) if n_channels == 1 else (n_samples, n_channels)
+            sig = np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=shape)
+        return cls(sig, sr, axis=axis, history=[('initialized', None), ('from_file', fname)], t0=t0)
+
     def __call__(self, col=None):
         """Return either a specific column or the entire set 2D signal"""
         if col is None:
@@ -364,20 +992,40 @@ class Data: # Signal processing
         if his_append is None:
             his = self._history # only useful when cloning without manipulating the data, e.g. returning a subset of columns
         else:
-            his = self._history + [his_append]
-        return self.__class__(proc_sig, self.sr, self.axis, his, self._t0)
+            his = self._history + [provenance.entry(*his_append)]
+        ret = self.__class__(proc_sig, self.sr, self.axis, his, self._t0)
+        if ret._sig is self._sig: # e.g. shift_left
+            ret._cow = self._cow = True
+        return ret
+
+    def lazy(self):
+        """Start a deferred pipeline of operations on this signal. See LazyData."""
+        return LazyData(self)
+
+    def chunked(self, chunk_size=2**20, out_dir=None):
+        """Process this signal in blocks, and stream the results to disk. See Chunked."""
+        return Chunked(self, chunk_size, out_dir)
+
+    def _analytic(self):
+        """Analytic signal, cached on this object until the samples change (e.g. d()[:] = 0.). See analytic_signal."""
+        digest = (array_digest(self._sig), FFT_PAD_FAST_LEN)
+        cached = getattr(self, '_analytic_cache', None)
+        if cached is None or cached[0] != digest:
+            self._analytic_cache = cached = (digest, analytic_signal(self._sig, axis=self.axis))
+        return cached[1]
 
     def analytic(self):
-        proc_sig = hilbert(self._sig, axis=self.axis)
-        return self._clone(proc_sig, ('analytic', None))
+        ret = self._clone(self._analytic(), ('analytic', None))
+        ret._cow = True # shares the cached analytic signal
+        return ret
 
     def envelope(self, type='upper', lowpass=True):
         # analytic envelope, optionally low-passed
         assert type in ('upper', 'lower')
         if type == 'upper':
-            proc_sig = np.abs(hilbert(self._sig, axis=self.axis))
-        else:
-            proc_sig = -np.abs(hilbert(-self._sig, axis=self.axis))
+            proc_sig = np.abs(self._analytic())
+        else: # the analytic signal of -x is the negative of that of x
+            proc_sig = -np.abs(self._analytic())
 
         if lowpass:
             if lowpass is True: # set cutoff frequency to lower end of bandpass filter
@@ -388,17 +1036,18 @@ class Data: # Signal processing
         return self._clone(proc_sig, ('envelope_'+type, None))
     
     def phase(self):
-        proc_sig = np.unwrap(np.angle(hilbert(self._sig, axis=self.axis)))
+        proc_sig = np.unwrap(np.angle(self._analytic()))
         return self._clone(proc_sig, ('instantaneous_phase', None))
     
     def instantaneous_frequency(self):
-        proc_sig = np.diff(self.phase()._sig) / (2.0*np.pi) * self.sr
+        proc_sig = np.diff(self.phase()._sig, axis=self.axis) / (2.0*np.pi) * self.sr
         return self._clone(proc_sig, ('instantaneous_frequency', None))
 
+    @cached_result
     def bandpass(self, low, high, order=None):
         if order is None:
             order = int(self.sr/2) + 1
-        filt_pts = firwin(order, (low, high), fs=self.sr, pass_zero='bandpass')
+        filt_pts = filter_cache.firwin(order, (low, high), self.sr, 'bandpass')
         proc_sig = filtfilt(filt_pts, 1, self._sig, axis=self.axis)
         return self._clone(proc_sig, ('bandpass', {'filter':'firwin', 'low':low, 'high':high, 'order':order}))
 
@@ -406,17 +1055,9 @@ class Data: # Signal processing
         assert btype in ('low', 'high')
         if order is None:
             order = 6
-        b, a = butter(order, cutoff/(0.5*self.sr), btype=btype, analog=False)
-
-        nan_manip = False
-        if (nan_bool := np.isnan(self._sig)).any():
-            nan_manip = True
-            self = self.interpnan() # interpolate missing values before applying an IIR filter
-
-        proc_sig = filtfilt(b, a, self._sig, axis=self.axis)
-        if nan_manip:
-            proc_sig[nan_bool] = np.NaN # put back the NaNs in the same place
-
+        sos = filter_cache.butter(order, cutoff, self.sr, btype)
+        nan_manip = not np.isfinite(self._sig).all()
+        proc_sig = sosfiltfilt_finite(sos, self._sig, axis=self.axis) # NaN stretches are left in place
         return self._clone(proc_sig, (btype+'pass', {'filter':'butter', 'cutoff':cutoff, 'order':order, 'NaN manipulation': nan_manip}))
 
     def lowpass(self, cutoff, order=None):
@@ -427,38 +1068,42 @@ class Data: # Signal processing
     
     def get_trend_airPLS(self, *args, **kwargs):
         from airPLS import airPLS
-        trend = np.apply_along_axis(airPLS, self.axis, self._sig, *args, **kwargs)
+        trend = apply_along_axis(airPLS, self.axis, self._sig, *args, **kwargs)
         return self._clone(trend, ('get_trend_airPLS', {'args':args, **kwargs}))
         
+    @cached_result
     def detrend_airPLS(self, *args, **kwargs):
         trend = self.get_trend_airPLS(*args, **kwargs)
         proc_sig = self._sig - trend()
         return self._clone(proc_sig, ('detrend_airPLS', {'args':args, **kwargs}))
 
-    def medfilt(self, order=11):
+    @cached_result
+    def medfilt(self, order=11, mode='keep'):
         """
-        Median filter the signal
+        Median filter the signal, channel by channel, using a running median (see running_median)
         
         order is the number of samples in the kernel if it is an int, and treated as time if it is a float
+        mode is 'keep' to leave the ends of the signal unfiltered, or a scipy.ndimage edge mode ('reflect', 'nearest', 'mirror', 'constant', 'wrap')
         """
-        sw = np.lib.stride_tricks.sliding_window_view # this should be much faster than using running window
         if isinstance(order, float):
             order = int(order*self.sr)
         assert isinstance(order, int)
         order = (order // 2)*2 + 1 # ensure order is odd for simpler handling of time
-        proc_sig_middle = np.median(sw(self._sig, order, axis=self.axis), axis=-1)
-        pre_fill = np.take(self._sig, np.r_[:order//2], axis=self.axis)
-        post_fill = np.take(self._sig, np.r_[-order//2+1:0], axis=self.axis)
-        proc_sig = np.concatenate((pre_fill, proc_sig_middle, post_fill)) # ends of the signal will not be filtered
-        return self._clone(proc_sig, ('median_filter', {'order': order, 'kernel_size_s': order/self.sr}))
+        proc_sig = running_median(self._sig, order, axis=self.axis, mode=mode)
+        return self._clone(proc_sig, ('median_filter', {'order': order, 'kernel_size_s': order/self.sr, 'mode': mode}))
     
     def interpnan(self, maxgap=None, **kwargs):
         """
         Only interpolate values within the mask
         kwargs will be passed to scipy.interpolate.interp1d
+        Linear and nearest interpolation (with the default extrapolation)
+        are done for all channels at once using interpnan_nd.
         """
-        proc_sig = np.apply_along_axis(interpnan, self.axis, self._sig, maxgap, **kwargs)
-        return self._clone(proc_sig, ('instantaneous_phase', None))
+        if _interpnan_vectorizable(kwargs):
+            proc_sig = interpnan_nd(self._sig, self.axis, maxgap, **kwargs)
+        else:
+            proc_sig = apply_along_axis(interpnan, self.axis, self._sig, maxgap, **kwargs)
+        return self._clone(proc_sig, ('interpnan', {'maxgap': maxgap, **kwargs}))
 
     def shift_baseline(self, offset): 
         # you can use numpy broadcasting to shift each signal if multi-dimensional
@@ -481,6 +1126,11 @@ class Data: # Signal processing
     def t(self):
         n_samples = len(self)
         return np.linspace(self._t0, self._t0 + (n_samples-1)/self.sr, n_samples)
+
+    @property
+    def time_axis(self):
+        """Time vector that is computed on demand (t0 + k/sr), for indexing and searching without making the array. See TimeAxis."""
+        return TimeAxis(self._t0, self.sr, len(self))
     
     @property
     def dur(self):
@@ -510,21 +1160,64 @@ class Data: # Signal processing
             if key.start is None:
                 intvl_start = self.t_start()
             else:
-                intvl_start = self.t[sorted((0, key.start, len(self)-1))[1]] # clip to limits
+                intvl_start = self._t0 + sorted((0, key.start, len(self)-1))[1]/self.sr # clip to limits
             if key.stop is None:
                 intvl_end = self.t_end()
             else:
-                intvl_end = self.t[sorted((0, key.stop-1, len(self)-1))[1]]
+                intvl_end = self._t0 + sorted((0, key.stop-1, len(self)-1))[1]/self.sr
         return Interval(float(intvl_start), float(intvl_end), sr=self.sr)
 
-    def take_by_interval(self, key: Interval):
+    def _interval_to_range(self, key: Interval):
+        """Start (inclusive) and end (exclusive) indices of an interval, clipped to the signal"""
         assert key.sr == self.sr
-        his = self._history + [('slice', key)]
         offset = round(self._t0*self.sr)
         rng_start = sorted((0, key.start.sample-offset, len(self)-1))[1]
         rng_end = sorted((0, key.end.sample-offset+1, len(self)))[1] # +1 because interval object includes both ends!
-        proc_sig = self._sig.take(indices=range(rng_start, rng_end), axis=self.axis)
-        return self.__class__(proc_sig, self.sr, self.axis, his, self.t[rng_start])
+        return rng_start, rng_end
+
+    def take_by_interval(self, key: Interval):
+        """
+        The returned object is a read-only view into this signal (only the
+        touched pages are read from memory-mapped files). Either of them is
+        copied if it is modified later (see __setitem__), so assignments to
+        one don't show up in the other. Copy the samples (e.g. x[1.:2.]().copy())
+        to modify them in place.
+        """
+        his = self._history + [provenance.entry('slice', key)]
+        rng_start, rng_end = self._interval_to_range(key)
+        proc_sig = self._sig[_axis_slice(self._sig.ndim, self.axis, rng_start, rng_end)]
+        proc_sig.flags.writeable = False # protect the parent signal
+        ret = self.__class__(proc_sig, self.sr, self.axis, his, self._t0 + rng_start/self.sr)
+        ret._cow = self._cow = True # the parent shares its buffer with the view
+        return ret
+
+    def _sig_for_write(self):
+        """Copy-on-write. Signals shared with other Data objects are copied before they are modified in place."""
+        if getattr(self, '_cow', False) or not self._sig.flags.writeable:
+            self._sig = self._sig.copy()
+            self._cow = False
+        return self._sig
+
+    def __setitem__(self, key, value):
+        """
+        Assign values to a stretch of the signal, without modifying any
+        other Data object that shares it (copy-on-write).
+        Keys are interpreted as in __getitem__.
+        Example:
+            x[10.:12.] = np.nan     # blank an artifact
+            x[5] = 0.
+        """
+        if isinstance(key, int):
+            key = key % len(self)
+            rng_start, rng_end = key, key+1
+        else:
+            assert isinstance(key, (Interval, slice))
+            if isinstance(key, slice):
+                key = self._slice_to_interval(key)
+            rng_start, rng_end = self._interval_to_range(key)
+        self._sig_for_write()[_axis_slice(self._sig.ndim, self.axis, rng_start, rng_end)] = value
+        self._analytic_cache = None
+        self._history = self._history + [('assign', {'start': self._t0 + rng_start/self.sr, 'end': self._t0 + (rng_end-1)/self.sr})]
 
     def __getitem__(self, key):
         """
@@ -535,7 +1228,7 @@ class Data: # Signal processing
             x3 = sampled.Data(np.random.random((10, 3)), sr=2, t0=5.)
             
             Indexing with list, tuple, int, or float will return numpy arrays:
-                x3[[5.05, 5.45]]                    # returns linearly interpolated values
+                x3[[5.05, 5.45]]                    # returns linearly interpolated values (use x3.at for other kinds)
                 x3[5.05]                            # returns linearly interpolated value
                 x3[2.]                              # this should error out because it is outside the range
                 x3[2], x3[-1], x3[len(x3)-1]        # this is effectively like array-indexing, last two should be the same
@@ -548,35 +1241,116 @@ class Data: # Signal processing
                 x3[:5.5]()                          # should return first two values 
                 x3[0:5.5](), x3[5.0:5.5]()          # should be the same as above, also examine x3[0:5.5].interval().start -> this should be 5.0
         """
-        if isinstance(key, (list, tuple, float, int)): # return signal (interpolated if needbe) values at those times
-            if isinstance(key, int):
-                key = self.t[key]
-            return interp1d(self.t, self._sig, axis=self.axis)(key)
+        if isinstance(key, int):
+            return np.take(self._sig, key, axis=self.axis)
+        if isinstance(key, (list, tuple, float, np.ndarray)): # return signal (interpolated if needbe) values at those times
+            return self.at(key)
 
         assert isinstance(key, (Interval, slice))
         if isinstance(key, slice):
             key = self._slice_to_interval(key)
         return self.take_by_interval(key)
 
-    def make_running_win(self, win_size=0.25, win_inc=0.1):
+    def at(self, times, kind='linear'):
+        """
+        Signal values at the query times (float, list, or array in
+        seconds). Indices and weights are computed from t0 and sr, so the
+        cost depends only on the number of query times.
+            kind - 'nearest', 'linear', or 'cubic' (Catmull-Rom, using 4 neighbouring samples)
+        Times outside the signal raise a ValueError.
+        Example:
+            x.at(event_times, kind='cubic')
+        """
+        assert kind in ('nearest', 'linear', 'cubic')
+        n_samples = len(self)
+        times = np.asarray(times, dtype=float)
+        pos = np.atleast_1d((times - self._t0)*self.sr) # fractional sample index
+        tol = 1e-6
+        if np.any(pos < -tol) or np.any(pos > n_samples - 1 + tol):
+            raise ValueError("A value in times is outside the signal range " + str((self.t_start(), self.t_end())))
+        pos = np.clip(pos, 0, n_samples-1)
+
+        def reshape_weights(w):
+            shape = [1]*self._sig.ndim
+            shape[self.axis] = len(w)
+            return w.reshape(shape)
+
+        if kind == 'nearest' or n_samples == 1:
+            ret = np.take(self._sig, np.ceil(pos - 0.5).astype(int), axis=self.axis) # round half down, like interp1d
+        else:
+            idx = np.minimum(np.floor(pos).astype(int), n_samples-2)
+            frac = pos - idx
+            if kind == 'linear':
+                idx_list = (idx, idx+1)
+                weights = (1. - frac, frac)
+            else:
+                idx_list = [np.clip(idx + k, 0, n_samples-1) for k in (-1, 0, 1, 2)]
+                weights = _catmull_rom_weights(frac)
+            ret = sum(np.take(self._sig, i, axis=self.axis)*reshape_weights(w) for i, w in zip(idx_list, weights))
+        if times.ndim == 0:
+            return np.take(ret, 0, axis=self.axis)
+        return ret
+
+    def _running_win_samples(self, win_size, win_inc):
         win_size_samples = (round(win_size*self.sr)//2)*2 + 1 # ensure odd number of samples
         win_inc_samples = round(win_inc*self.sr)
+        return win_size_samples, win_inc_samples
+
+    def make_running_win(self, win_size=0.25, win_inc=0.1):
         n_samples = len(self)
-        return RunningWin(n_samples, win_size_samples, win_inc_samples)
+        return RunningWin(n_samples, *self._running_win_samples(win_size, win_inc))
 
-    def apply_running_win(self, func, win_size=0.25, win_inc=0.1):
+    def apply_running_win(self, func, win_size=0.25, win_inc=0.1, threshold=None, batch_size=4096):
         """
-        Process the signal using a running window by applying func to each window.
+        Process the signal using a running window.
+        func is either 
+            (str) a built-in reducer, computed for all channels in O(N)
+                'mean', 'rms', 'var', 'min', 'max', 'count_above' (number of values > threshold)
+            (callable) func(window, axis), where window has the same layout as the signal.
+                Windows are strided views, and func is called on batches of
+                windows (batch_size windows stacked along a new first axis, 
+                with time along axis+1) when it gives the same result as
+                calling it on one window. Otherwise, it is called once per window.
         Returns:
             Sampled data 
         Example:
             Extract RMS envelope
-            self.apply_running_win(lambda x: np.sqrt(np.mean(x**2)), win_size, win_inc)
+            self.apply_running_win('rms', win_size, win_inc)
+            self.apply_running_win(lambda x, axis: np.sqrt(np.mean(x**2, axis=axis)), win_size, win_inc)
         """
-        rw = self.make_running_win(win_size, win_inc)
-        ret_sig = np.array([func(self._sig[r_win], self.axis) for r_win in rw()])
-        ret_sr = self.sr/round(win_inc*self.sr)
-        return Data(ret_sig, ret_sr, axis=self.axis, t0=self.t[rw.center_idx[0]])
+        win_size, win_inc = self._running_win_samples(win_size, win_inc)
+        if isinstance(func, str):
+            ret_sig = running_reduce(self._sig, func, win_size, win_inc, axis=self.axis, threshold=threshold)
+        else:
+            ret_sig = self._running_apply(func, win_size, win_inc, (len(self) - win_size)//win_inc + 1, batch_size)
+        ret_sr = self.sr/win_inc
+        return Data(ret_sig, ret_sr, axis=self.axis, t0=self._t0 + (win_size//2)/self.sr) # time of the center of the first window
+
+    def _running_apply(self, func, win_size, win_inc, n_win, batch_size):
+        """Apply a callable to batches of strided windows, with the window index along self.axis in the output"""
+        # windows x (signal layout), with time along axis+1
+        win_view = np.lib.stride_tricks.sliding_window_view(self._sig, win_size, axis=self.axis)
+        win_view = np.moveaxis(win_view, (self.axis, -1), (0, self.axis+1))[::win_inc][:n_win]
+        batched = None
+        ret = []
+        for batch_start in range(0, n_win, batch_size):
+            batch = win_view[batch_start:batch_start+batch_size]
+            if batched is None: # check if func can handle a batch of windows
+                first_win = np.asarray(func(batch[0], self.axis))
+                try:
+                    batch_res = np.asarray(func(batch, self.axis+1))
+                    batched = batch_res.shape == (len(batch),) + first_win.shape and np.allclose(batch_res[0], first_win, equal_nan=True)
+                except Exception: #pylint: disable=broad-except
+                    batched = False
+            elif batched:
+                batch_res = np.asarray(func(batch, self.axis+1))
+            if not batched:
+                batch_res = np.asarray([func(win, self.axis) for win in batch])
+            ret.append(batch_res)
+        ret = np.concatenate(ret)
+        if ret.ndim == self._sig.ndim: # one value per channel in each window
+            ret = np.moveaxis(ret, 0, self.axis)
+        return ret
     
     def __le__(self, other): return self._comparison('__le__', other)
     def __ge__(self, other): return self._comparison('__ge__', other)
@@ -592,9 +1366,14 @@ class Data: # Signal processing
         return self._clone(getattr(self._sig, dunder)(other), (cmp_dunder_dict[dunder], other))
     
     def onoff_times(self):
-        """Onset and offset times of a thresholded 1D sampled.Data object"""
-        onset_samples, offset_samples = onoff_samples(self._sig)
-        return [self.t[x] for x in onset_samples], [self.t[x] for x in offset_samples]
+        """
+        Onset and offset times of a thresholded sampled.Data object.
+        Returns arrays for 1D signals, and lists of arrays (one per channel) for 2D signals.
+        """
+        onset_samples, offset_samples = onoff_samples(self._sig, axis=self.axis)
+        if self._sig.ndim == 1:
+            return self._t0 + onset_samples/self.sr, self._t0 + offset_samples/self.sr
+        return [self._t0 + x/self.sr for x in onset_samples], [self._t0 + x/self.sr for x in offset_samples]
 
     def fft(self, **kwargs):
         """kwargs get passed to scipy.signal.fft"""
@@ -604,6 +1383,84 @@ class Data: # Signal processing
         amp = 2.0/N * np.abs(fft(self._sig, **kwargs)[0:N//2])
         return f, amp
     
+    def _segment_spectra(self, tapers, nperseg, noverlap, batch_size):
+        """
+        Generator of one-sided power spectral densities of detrended
+        (constant) segments, in batches of batch_size segments.
+        tapers is a (n_tapers, nperseg) array, and spectra are averaged across tapers.
+        Yields arrays of shape (channels..., segments, frequencies).
+        Only the samples in each batch are read, so this works on memory-mapped signals.
+        """
+        step = nperseg - noverlap
+        n_seg = (len(self) - nperseg)//step + 1
+        assert n_seg > 0
+        sig_t = np.moveaxis(self._sig, self.axis, -1) # time is the last axis
+        scale = np.full(nperseg//2 + 1, 2./(self.sr*np.sum(tapers[0]**2)))
+        scale[0] /= 2.
+        if nperseg % 2 == 0:
+            scale[-1] /= 2. # Nyquist
+        for seg_start in range(0, n_seg, batch_size):
+            seg_stop = min(seg_start + batch_size, n_seg)
+            span = np.asarray(sig_t[..., seg_start*step:(seg_stop-1)*step + nperseg], dtype=float)
+            segs = np.lib.stride_tricks.sliding_window_view(span, nperseg, axis=-1)[..., ::step, :]
+            segs = segs - segs.mean(axis=-1, keepdims=True)
+            spec = sp_fft.rfft(segs[..., None, :]*tapers, axis=-1, workers=FFT_WORKERS) # channels..., segments, tapers, frequencies
+            yield np.mean(spec.real**2 + spec.imag**2, axis=-2)*scale
+
+    def psd(self, nperseg=256, noverlap=None, window='hann', batch_size=256):
+        """
+        Power spectral density using Welch's method (density scaling, same as scipy.signal.welch).
+        Segments are processed in batches with multithreaded FFTs across channels and segments.
+        Returns:
+            f (frequencies in Hz), pxx (frequency along self.axis)
+        """
+        nperseg = min(nperseg, len(self))
+        if noverlap is None:
+            noverlap = nperseg//2
+        tapers = np.atleast_2d(get_window(window, nperseg))
+        return self._averaged_spectrum(tapers, nperseg, noverlap, batch_size)
+
+    def multitaper(self, NW=4, n_tapers=None, nperseg=None, noverlap=0, batch_size=16):
+        """
+        Multitaper power spectral density with discrete prolate spheroidal (Slepian) tapers.
+            NW - time-halfbandwidth product, n_tapers defaults to 2*NW - 1
+            nperseg - by default, the whole signal is one segment. Use
+                shorter segments to average multitaper estimates across a long recording.
+        Returns:
+            f (frequencies in Hz), pxx (frequency along self.axis)
+        """
+        if nperseg is None:
+            nperseg = len(self)
+        if n_tapers is None:
+            n_tapers = int(2*NW - 1)
+        tapers = np.atleast_2d(dpss(nperseg, NW, Kmax=n_tapers))
+        return self._averaged_spectrum(tapers, nperseg, noverlap, batch_size)
+
+    def _averaged_spectrum(self, tapers, nperseg, noverlap, batch_size):
+        pxx, n_seg = 0., 0
+        for spec in self._segment_spectra(tapers, nperseg, noverlap, batch_size):
+            pxx = pxx + spec.sum(axis=-2)
+            n_seg += spec.shape[-2]
+        f = sp_fft.rfftfreq(nperseg, 1/self.sr)
+        return f, np.moveaxis(pxx/n_seg, -1, self.axis)
+
+    def spectrogram(self, nperseg=256, noverlap=None, window=('tukey', 0.25), batch_size=256):
+        """
+        Spectrogram (density scaling, same as scipy.signal.spectrogram), computed in batches of segments.
+        Returns:
+            f (frequencies in Hz),
+            t (time at the center of each segment, starting from t0),
+            sxx (channels..., frequencies, time)
+        """
+        nperseg = min(nperseg, len(self))
+        if noverlap is None:
+            noverlap = nperseg//8
+        tapers = np.atleast_2d(get_window(window, nperseg))
+        sxx = np.concatenate(list(self._segment_spectra(tapers, nperseg, noverlap, batch_size)), axis=-2)
+        f = sp_fft.rfftfreq(nperseg, 1/self.sr)
+        t = self._t0 + (np.arange(sxx.shape[-2])*(nperseg - noverlap) + nperseg/2)/self.sr
+        return f, t, np.swapaxes(sxx, -1, -2)
+
     def diff(self):
         if self._sig.ndim == 2:
             if self.axis == 1:
@@ -624,12 +1481,22 @@ class Data: # Signal processing
         return Data(np.linalg.norm(self._sig, axis=(self.axis+1)%2), self.sr, history=self._history+[('magnitude', 'None')])
 
     def apply(self, func, *args, **kwargs):
-        try:
-            kwargs['axis'] = self.axis
-            proc_sig = func(self._sig, *args, **kwargs)
-        except TypeError:
-            kwargs.pop('axis')
-            proc_sig = func(self._sig, *args, **kwargs)
+        """func is called with axis=self.axis if it accepts it. See parallel for running groups of channels in parallel."""
+        if PARALLEL['n_workers'] > 1 and self._sig.ndim == 2:
+            rows = np.moveaxis(self._sig, self.axis, -1) # channels x time
+            results = _map_rows(_apply_to_rows, rows, False, (func, self.axis, args, kwargs))
+            ch_axis = (self.axis+1)%2
+            if all(r[0].ndim == 2 and r[0].shape[ch_axis] == r[2] for r in results): # channels are kept along the same axis
+                proc_sig = np.concatenate([r[0] for r in results], axis=ch_axis)
+            elif all(r[0].ndim == 1 and len(r[0]) == r[2] for r in results): # one value per channel, e.g. np.mean
+                proc_sig = np.concatenate([r[0] for r in results])
+            else: # channels can't be matched to the output, use the serial path
+                proc_sig = None
+            kwargs = results[0][1]
+        else:
+            proc_sig = None
+        if proc_sig is None:
+            proc_sig, kwargs = _apply_with_axis(func, self._sig, self.axis, args, kwargs)
         return self._clone(proc_sig, ('apply', {'func': func, 'args': args, 'kwargs': kwargs}))
     
     def regress(self, ref_sig):
@@ -642,12 +1509,440 @@ class Data: # Signal processing
         prediction = reg.coef_[0]*ref_sig() + reg.intercept_
         return self._clone(self() - prediction, ('Regressed with reference', ref_sig()))
     
-    def resample(self, new_sr, *args, **kwargs):
-        """args and kwargs will be passed to scipy.signal.resample"""
-        proc_sig = resample(self._sig, round(len(self)*new_sr/self.sr), axis=self.axis, *args, **kwargs)
-        return self.__class__(proc_sig, sr=new_sr, axis=self.axis, history=self._history+[('resample', new_sr)], t0=self._t0)
+    @cached_result
+    def resample(self, new_sr, *args, method=None, **kwargs):
+        """
+        Resample the signal at new_sr. The first sample stays at t0.
+        method -
+            None - 'poly' if new_sr/sr is a ratio of small integers (see rational_ratio), 'fft' otherwise
+            'poly' - polyphase filtering (scipy.signal.resample_poly), ceil(len*new_sr/sr) samples
+            'fft' - scipy.signal.resample, round(len*new_sr/sr) samples
+        args and kwargs will be passed to scipy.signal.resample_poly or scipy.signal.resample
+        Example:
+            x.resample(180) # 2000 Hz -> 180 Hz uses up=9, down=100
+        """
+        ratio = rational_ratio(new_sr, self.sr)
+        if method is None:
+            method = 'poly' if ratio is not None and not args else 'fft'
+        assert method in ('poly', 'fft')
+        if method == 'poly':
+            assert ratio is not None
+            up, down = ratio
+            proc_sig = resample_poly(self._sig, up, down, self.axis, *args, **kwargs)
+            his = {'new_sr': new_sr, 'method': method, 'up': up, 'down': down}
+        else:
+            proc_sig = resample(self._sig, round(len(self)*new_sr/self.sr), axis=self.axis, *args, **kwargs)
+            his = {'new_sr': new_sr, 'method': method}
+        return self.__class__(proc_sig, sr=new_sr, axis=self.axis, history=self._history+[provenance.entry('resample', his)], t0=self._t0)
         
 
+class LazyData:
+    """
+    Deferred chain of sampled.Data operations, created using Data.lazy()
+    Operations are recorded instead of being executed. The chain runs when
+    the samples or the history are requested (__call__, .t, _history, or
+    explicitly using compute). sr, axis, _t0 and len are worked out from
+    the source without running the chain, unless a step such as apply
+    makes them unknown.
+    Consecutive elementwise operations (shift_baseline, scale,
+    comparisons) are fused into a single pass over one buffer, and each
+    intermediate signal is released as soon as the next step is done.
+
+    Example:
+        x = sampled.Data(np.random.random((20000, 16)), sr=2000)
+        env = x.lazy().bandpass(20, 450).envelope().shift_baseline(0.1).scale(2.)
+        env.pending     # planned operations, nothing has been computed
+        env.sr
+        env()           # runs the pipeline, and returns the numpy array
+        env.compute()   # returns the computed sampled.Data object
+    """
+    _deferred = ('analytic', 'envelope', 'phase', 'instantaneous_frequency', 
+        'bandpass', 'lowpass', 'highpass', 'get_trend_airPLS', 'detrend_airPLS', 
+        'medfilt', 'interpnan', 'shift_baseline', 'shift_left', 'scale', 
+        'diff', 'magnitude', 'apply', 'regress', 'resample', 'take_by_interval')
+    # operation name -> (numpy ufunc, history label, output has the same dtype as the input)
+    _elementwise = {
+        'shift_baseline': (np.subtract, 'shift_baseline', True),
+        'scale': (np.true_divide, 'scale', True),
+        '__le__': (np.less_equal, '<=', False),
+        '__ge__': (np.greater_equal, '>=', False),
+        '__lt__': (np.less, '<', False),
+        '__gt__': (np.greater, '>', False),
+        '__eq__': (np.equal, '==', False),
+        '__ne__': (np.not_equal, '!=', False),
+    }
+
+    def __init__(self, data, ops=None):
+        assert isinstance(data, Data)
+        self._source = data
+        self._ops = [] if ops is None else ops # list of (name, args, kwargs, (name, params))
+        self._result = None
+
+    def _record(self, name, *args, **kwargs):
+        if name in self._elementwise:
+            assert not kwargs and len(args) == 1
+            if name in ('shift_baseline', 'scale'):
+                assert not isinstance(args[0], Data)
+            else:
+                assert isinstance(args[0], (int, float))
+            entry = provenance.entry(self._elementwise[name][1], args[0]) # same as the history entry of the operation
+        else:
+            bound = inspect.signature(getattr(Data, name)).bind(None, *args, **kwargs)
+            bound.apply_defaults()
+            entry = provenance.entry(name, {k: v for k, v in list(bound.arguments.items())[1:]})
+        return LazyData(self._source, self._ops + [(name, args, kwargs, entry)])
+
+    def __getattr__(self, name):
+        if name in self._deferred:
+            return lambda *args, **kwargs: self._record(name, *args, **kwargs)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.compute(), name) # sr, axis, dur, etc.
+
+    def __le__(self, other): return self._record('__le__', other)
+    def __ge__(self, other): return self._record('__ge__', other)
+    def __lt__(self, other): return self._record('__lt__', other)
+    def __gt__(self, other): return self._record('__gt__', other)
+    def __eq__(self, other): return self._record('__eq__', other)
+    def __ne__(self, other): return self._record('__ne__', other)
+
+    @property
+    def pending(self):
+        """Operations in the pipeline as (method name, parameters). Run compute to get the history."""
+        return [op[-1] for op in self._ops]
+
+    @property
+    def _history(self):
+        return self.compute()._history
+
+    def _metadata(self):
+        """sr, axis, t0 and number of samples after the pipeline, without running it. Unknown values are None."""
+        data = self._source
+        sr, axis, t0, n = data.sr, data.axis, data._t0, len(data)
+        for name, args, kwargs, (_, params) in self._ops:
+            if name == 'resample':
+                sr, n = params['new_sr'], None
+            elif name == 'shift_left':
+                t0 = 0. if params['time'] is None or t0 is None else t0 - params['time']
+            elif name == 'magnitude':
+                axis, t0 = 0, 0. # see Data.magnitude
+            elif name == 'instantaneous_frequency':
+                n = None if n is None else n-1
+            elif name in ('apply', 'regress'): # the output shape depends on the inputs
+                n = None
+                if name == 'apply':
+                    axis = t0 = None
+            elif name == 'take_by_interval':
+                key = args[0] if args else kwargs['key'] # params has the compacted Interval
+                if n is None or t0 is None:
+                    t0 = None
+                    continue
+                offset = round(t0*sr) # see Data._interval_to_range
+                rng_start = sorted((0, key.start.sample-offset, n-1))[1]
+                rng_end = sorted((0, key.end.sample-offset+1, n))[1]
+                t0, n = t0 + rng_start/sr, rng_end - rng_start
+        return sr, axis, t0, n
+
+    @property
+    def sr(self):
+        return self._metadata()[0]
+
+    @property
+    def axis(self):
+        axis = self._metadata()[1]
+        return self.compute().axis if axis is None else axis
+
+    @property
+    def _t0(self):
+        t0 = self._metadata()[2]
+        return self.compute()._t0 if t0 is None else t0
+
+    def compute(self):
+        """Execute the pipeline, and return a sampled.Data object"""
+        if self._result is None:
+            cur = self._source
+            op_count = 0
+            while op_count < len(self._ops):
+                name, args, kwargs, _ = self._ops[op_count]
+                if name in self._elementwise:
+                    fuse_end = op_count
+                    while fuse_end < len(self._ops) and self._ops[fuse_end][0] in self._elementwise:
+                        fuse_end += 1
+                    cur = self._run_fused(cur, self._ops[op_count:fuse_end])
+                    op_count = fuse_end
+                else:
+                    cur = getattr(cur, name)(*args, **kwargs) # previous intermediate is released here
+                    op_count += 1
+            self._result = cur
+        return self._result
+
+    def _run_fused(self, data, ops):
+        """Apply a sequence of elementwise operations, re-using the buffer created by the first one"""
+        buf = None
+        his = list(data._history)
+        for name, args, _, his_entry in ops:
+            ufunc, _, same_dtype = self._elementwise[name]
+            if buf is None: # never write into the source signal
+                buf = ufunc(data._sig, args[0])
+            elif same_dtype and np.result_type(buf, args[0]) == buf.dtype and np.broadcast_shapes(buf.shape, np.shape(args[0])) == buf.shape:
+                ufunc(buf, args[0], out=buf)
+            else:
+                buf = ufunc(buf, args[0])
+            his.append(his_entry)
+        return data.__class__(buf, data.sr, data.axis, his, data._t0)
+
+    def __call__(self, col=None):
+        return self.compute()(col)
+
+    @property
+    def t(self):
+        return self.compute().t
+
+    def __len__(self):
+        n = self._metadata()[3]
+        return len(self.compute()) if n is None else n
+
+    def __getitem__(self, key):
+        return self.compute()[key]
+
+    def __repr__(self):
+        return "Lazy pipeline: " + " -> ".join(op[0] for op in self._ops) + " (" + ("computed" if self._result is not None else "pending") + ")"
+
+
+class Chunked:
+    """
+    Out-of-core processing of a sampled.Data object in blocks along the time axis.
+    Each block is read along with enough neighbouring samples for the
+    operation (overlap-save), processed in memory using the regular
+    sampled.Data method, and only the valid part is written to a
+    memory-mapped .npy file in out_dir. The padding is sized from the
+    impulse response of each filter.
+    Use this with signals that don't fit in memory, e.g. a Data object
+    created from a numpy.memmap.
+    Output files are kept until they are removed using cleanup (or on
+    exiting a with block). When out_dir is None, they are written to one
+    temporary directory per session, which is removed when Python exits.
+    Release the results (e.g. del y) before removing their files.
+
+    Example:
+        x = sampled.Data(np.load('emg.npy', mmap_mode='r'), sr=2000)
+        y = x.chunked(chunk_size=2**22, out_dir='D:/scratch').bandpass(20, 450)
+        env = y.chunked().lowpass(5)    # env() is memory-mapped from disk
+
+        with x.chunked() as ch:         # files are removed at the end of the block
+            peak = np.max(ch.bandpass(20, 450)())
+    """
+    _session_dir = None # default out_dir, see _default_out_dir
+
+    def __init__(self, data, chunk_size=2**20, out_dir=None):
+        assert isinstance(data, Data)
+        self.data = data
+        self.chunk_size = int(chunk_size)
+        if out_dir is None:
+            out_dir = self._default_out_dir()
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.files = [] # files written by this object
+
+    @classmethod
+    def _default_out_dir(cls):
+        if cls._session_dir is None:
+            cls._session_dir = tempfile.mkdtemp(prefix='pntools_')
+            atexit.register(shutil.rmtree, cls._session_dir, ignore_errors=True)
+        return cls._session_dir
+
+    def _out_file(self, name):
+        fname = os.path.join(self.out_dir, f'{name}_{uuid.uuid4().hex[:8]}.npy')
+        self.files.append(fname)
+        return fname
+
+    def cleanup(self):
+        """Remove the files written by this object. Results read from them must not be used afterwards."""
+        for fname in self.files:
+            with contextlib.suppress(OSError):
+                os.remove(fname)
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    def _run(self, name, margin, func):
+        """Apply func (sampled.Data -> sampled.Data of the same length) to overlapping blocks"""
+        data = self.data
+        n_samples = len(data)
+        ndim = data._sig.ndim
+        margin = int(margin)
+        min_span = 4*margin + 1 # filtfilt pads 3*len(filter) samples on each side
+        out = None
+        his_entry = None
+        for blk_start in range(0, n_samples, self.chunk_size):
+            blk_stop = min(blk_start + self.chunk_size, n_samples)
+            pad_start = max(0, blk_start - margin)
+            pad_stop = min(n_samples, blk_stop + margin)
+            if pad_stop - pad_start < min_span: # short blocks need enough samples for edge padding (e.g. filtfilt)
+                pad_stop = min(n_samples, pad_start + min_span)
+                pad_start = max(0, pad_stop - min_span)
+            blk = Data(data._sig[_axis_slice(ndim, data.axis, pad_start, pad_stop)], data.sr, data.axis, list(data._history), data._t0 + pad_start/data.sr)
+            proc = func(blk)
+            proc_sig = proc._sig[_axis_slice(ndim, data.axis, blk_start-pad_start, blk_stop-pad_start)]
+            if out is None:
+                out = np.lib.format.open_memmap(self._out_file(name), mode='w+', dtype=proc_sig.dtype, shape=data._sig.shape)
+                his_entry = proc._history[-1]
+            elif isinstance(his_entry[1], dict): # e.g. NaN manipulation in any of the blocks
+                his_entry = (his_entry[0], {k: (v or proc._history[-1][1][k]) if isinstance(v, bool) else v for k, v in his_entry[1].items()})
+            out[_axis_slice(ndim, data.axis, blk_start, blk_stop)] = proc_sig
+        out.flush()
+        return data.__class__(out, data.sr, data.axis, data._history + [his_entry], data._t0)
+
+    def bandpass(self, low, high, order=None):
+        if order is None:
+            order = int(self.data.sr/2) + 1
+        return self._run('bandpass', order, lambda blk: Data.bandpass.__wrapped__(blk, low, high, order)) # blocks are not stored in result_cache
+
+    def lowpass(self, cutoff, order=None):
+        margin = _impulse_len(filter_cache.butter(6 if order is None else order, cutoff, self.data.sr, 'low'))
+        return self._run('lowpass', margin, lambda blk: blk.lowpass(cutoff, order))
+
+    def highpass(self, cutoff, order=None):
+        margin = _impulse_len(filter_cache.butter(6 if order is None else order, cutoff, self.data.sr, 'high'))
+        return self._run('highpass', margin, lambda blk: blk.highpass(cutoff, order))
+
+    def medfilt(self, order=11, mode='keep'):
+        if isinstance(order, float):
+            order = int(order*self.data.sr)
+        return self._run('medfilt', order//2 + 1, lambda blk: Data.medfilt.__wrapped__(blk, order, mode))
+
+    def diff(self):
+        return self._run('diff', 1, lambda blk: blk.diff())
+
+    def resample(self, new_sr, **kwargs):
+        """
+        Polyphase resampling (see Data.resample), the output is the same as resampling the whole signal.
+        Blocks start at multiples of the decimation factor, and the padding is the half-length of the anti-aliasing filter.
+        kwargs are passed to scipy.signal.resample_poly
+        """
+        data = self.data
+        ratio = rational_ratio(new_sr, data.sr)
+        assert ratio is not None, 'Streaming resampling needs new_sr/sr to be a ratio of small integers'
+        up, down = ratio
+        n_samples = len(data)
+        ndim = data._sig.ndim
+        margin = -(-(10*max(up, down)//up + 1)//down)*down # resample_poly filter half-length is 10*max(up, down) at the upsampled rate
+        chunk_size = max(1, self.chunk_size//down)*down
+        out = None
+        for blk_start in range(0, n_samples, chunk_size):
+            blk_stop = min(blk_start + chunk_size, n_samples)
+            pad_start = max(0, blk_start - margin)
+            pad_stop = min(n_samples, blk_stop + margin)
+            blk = Data(data._sig[_axis_slice(ndim, data.axis, pad_start, pad_stop)], data.sr, data.axis, list(data._history), data._t0 + pad_start/data.sr)
+            proc = Data.resample.__wrapped__(blk, new_sr, method='poly', **kwargs) # blocks are not stored in result_cache
+            out_start, out_stop = blk_start*up//down, -(-blk_stop*up//down)
+            proc_sig = proc._sig[_axis_slice(ndim, data.axis, out_start - pad_start*up//down, out_stop - pad_start*up//down)]
+            if out is None:
+                out_shape = list(data._sig.shape)
+                out_shape[data.axis] = -(-n_samples*up//down)
+                out = np.lib.format.open_memmap(self._out_file('resample'), mode='w+', dtype=proc_sig.dtype, shape=tuple(out_shape))
+            out[_axis_slice(ndim, data.axis, out_start, out_stop)] = proc_sig
+        out.flush()
+        return data.__class__(out, new_sr, data.axis, data._history + [proc._history[-1]], data._t0)
+
+    def apply_running_win(self, func, win_size=0.25, win_inc=0.1, **kwargs):
+        """Windows are processed in batches, and the output is streamed to disk."""
+        data = self.data
+        win_size_samples, win_inc_samples = data._running_win_samples(win_size, win_inc)
+        n_win = (len(data) - win_size_samples)//win_inc_samples + 1
+        n_batch = max(1, self.chunk_size // win_inc_samples)
+        out = None
+        for win_start in range(0, n_win, n_batch):
+            win_stop = min(win_start + n_batch, n_win)
+            span = _axis_slice(data._sig.ndim, data.axis, win_start*win_inc_samples, (win_stop-1)*win_inc_samples + win_size_samples)
+            proc_sig = Data(data._sig[span], data.sr, data.axis).apply_running_win(func, win_size, win_inc, **kwargs)._sig
+            out_axis = data.axis if proc_sig.ndim == data._sig.ndim else 0
+            if out is None:
+                out_shape = list(proc_sig.shape)
+                out_shape[out_axis] = n_win
+                out = np.lib.format.open_memmap(self._out_file('running_win'), mode='w+', dtype=proc_sig.dtype, shape=tuple(out_shape))
+            out[_axis_slice(proc_sig.ndim, out_axis, win_start, win_stop)] = proc_sig
+        out.flush()
+        return Data(out, data.sr/win_inc_samples, axis=data.axis, t0=data._t0 + (win_size_samples//2)/data.sr)
+
+
+class StreamProcessor:
+    """
+    Causal, block-by-block processing of live acquisition data with a chain of filters.
+    Filter states are kept between blocks, so blocks can be of any size,
+    and the output is the same as processing the whole signal at once.
+    stages is a list of tuples:
+        ('lowpass', cutoff[, order])        Butterworth, second-order sections (order 6 by default)
+        ('highpass', cutoff[, order])
+        ('bandpass', low, high[, order])    FIR filter, same design as Data.bandpass
+        ('envelope', cutoff[, order])       full-wave rectification followed by a lowpass filter
+                                            (cutoff=None uses the lower cutoff of the preceding bandpass stage)
+    Example:
+        sp = sampled.StreamProcessor([('bandpass', 20, 450), ('envelope', None)], sr=2000)
+        for block in acquisition:   # (n_samples, n_channels) arrays
+            env = sp(block)         # sampled.Data with the correct t0
+        sp.latency                  # processing time of each block in seconds
+    """
+    def __init__(self, stages, sr, axis=0, t0=0.):
+        self.sr = float(sr)
+        self.axis = axis
+        self.t0 = t0
+        self.stages = []
+        for stage in stages:
+            name, params = stage[0], list(stage[1:])
+            assert name in ('lowpass', 'highpass', 'bandpass', 'envelope')
+            if name == 'bandpass':
+                low, high = params[:2]
+                order = params[2] if len(params) > 2 and params[2] is not None else int(self.sr/2) + 1
+                coeffs = filter_cache.firwin(order, (low, high), self.sr, 'bandpass')
+            else:
+                cutoff = params[0]
+                if cutoff is None:
+                    assert name == 'envelope'
+                    cutoff = [s['params'][0] for s in self.stages if s['name'] == 'bandpass'][-1]
+                order = params[1] if len(params) > 1 and params[1] is not None else 6
+                coeffs = filter_cache.butter(order, cutoff, self.sr, 'high' if name == 'highpass' else 'low')
+            self.stages.append({'name': name, 'params': tuple(params), 'coeffs': coeffs, 'zi': None})
+        self.reset()
+    
+    def reset(self):
+        """Clear filter states, and start counting samples from t0"""
+        for stage in self.stages:
+            stage['zi'] = None
+        self.n_samples = 0
+        self.latency = []
+
+    def __call__(self, block):
+        """Process a block of samples, and return it as sampled.Data"""
+        tic = time.perf_counter()
+        block = np.asarray(block)
+        x = block.astype(np.float32 if block.dtype == np.float32 else np.float64)
+        for stage in self.stages:
+            coeffs = stage['coeffs'].astype(x.dtype)
+            if stage['name'] == 'envelope':
+                x = np.abs(x)
+            if stage['name'] == 'bandpass':
+                if stage['zi'] is None:
+                    zi_shape = list(x.shape)
+                    zi_shape[self.axis] = len(coeffs) - 1
+                    stage['zi'] = np.zeros(zi_shape, dtype=x.dtype)
+                x, stage['zi'] = lfilter(coeffs, 1., x, axis=self.axis, zi=stage['zi'])
+            else:
+                if stage['zi'] is None:
+                    zi_shape = list(x.shape)
+                    zi_shape[self.axis] = 2
+                    stage['zi'] = np.zeros([len(coeffs)] + zi_shape, dtype=x.dtype)
+                x, stage['zi'] = sosfilt(coeffs, x, axis=self.axis, zi=stage['zi'])
+        ret = Data(x, self.sr, axis=self.axis, history=[('initialized', None), ('stream', [(s['name'],) + s['params'] for s in self.stages])], t0=self.t0 + self.n_samples/self.sr)
+        self.n_samples += x.shape[self.axis]
+        self.latency.append(time.perf_counter() - tic)
+        return ret
+
+
 class Event(Interval):
     def __init__(self, start, end=None, **kwargs):
         """
@@ -671,14 +1966,408 @@ class Event(Interval):
 
 
 class Events(list):
-    """List of event objects that can be selected by labels using the 'get' method."""
+    """
+    List of event objects that can be selected by labels using the 'get' method.
+    Overlap queries use an IntervalIndex (interval_index), built on first use and updated on append.
+    """
     def append(self, key):
         assert isinstance(key, (Event, Interval))
-        super().append(Event(key))
+        if not isinstance(key, Event): # events are added as they are, to keep their labels
+            key = Event(key, iter_rate=key.iter_rate)
+        super().append(key)
+        if getattr(self, '_interval_index', None) is not None:
+            self._interval_index.append(key.start.sample, key.end.sample)
     
     def get(self, label):
         return Events([e for e in self if label in e.labels])
 
+    # other changes to the list discard the interval index
+    def __setitem__(self, key, value):
+        self._interval_index = None
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._interval_index = None
+        super().__delitem__(key)
+
+    def __iadd__(self, other):
+        self._interval_index = None
+        return super().__iadd__(other)
+
+    def insert(self, index, key):
+        self._interval_index = None
+        super().insert(index, key)
+
+    def extend(self, keys):
+        self._interval_index = None
+        super().extend(keys)
+
+    def pop(self, index=-1):
+        self._interval_index = None
+        return super().pop(index)
+
+    def remove(self, key):
+        self._interval_index = None
+        super().remove(key)
+
+    def clear(self):
+        self._interval_index = None
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self._interval_index = None
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._interval_index = None
+        super().reverse()
+
+    @property
+    def interval_index(self):
+        """IntervalIndex of these events. Rows are positions in this list."""
+        if getattr(self, '_interval_index', None) is None or len(self._interval_index) != len(self):
+            self._interval_index = IntervalIndex.from_events(self)
+        return self._interval_index
+
+    def _to_sample(self, t):
+        if isinstance(t, Time):
+            assert t.sr == self[0].sr
+            return t.sample
+        return Time(t, self[0].sr).sample # float is time, int is sample
+
+    def overlapping(self, start, end=None):
+        """Events that overlap the stretch from start to end (Time, float for time, int for sample), or include start if end is None"""
+        if not self:
+            return Events()
+        start = self._to_sample(start)
+        end = start if end is None else self._to_sample(end)
+        return Events([self[i] for i in self.interval_index.overlap(start, end).tolist()])
+
+    # set algebra over the samples covered by events (see interval_setop). These return unlabeled Events.
+    def _samples(self):
+        return np.array([e.start.sample for e in self], dtype=np.int64), np.array([e.end.sample for e in self], dtype=np.int64)
+
+    def _from_samples(self, start, end, sr):
+        return Events([Event(Time(s, sr), Time(e, sr)) for s, e in zip(start.tolist(), end.tolist())])
+
+    def _setop(self, other, how):
+        if isinstance(other, Interval):
+            other = Events([other])
+        sr = (self or other)[0].sr if (self or other) else 30.
+        assert all(e.sr == sr for e in list(self) + list(other))
+        return self._from_samples(*interval_setop(*self._samples(), *Events._samples(other), how=how), sr)
+
+    def union(self, other):
+        """Samples in these events or in other (Events or Interval)"""
+        return self._setop(other, 'union')
+
+    def intersection(self, other):
+        """Samples in these events and in other, e.g. bursts.intersection(stance)"""
+        return self._setop(other, 'intersection')
+
+    def difference(self, other):
+        """Samples in these events but not in other, e.g. movement.difference(artifacts)"""
+        return self._setop(other, 'difference')
+
+    def complement(self, bounds: Interval):
+        """Samples in bounds that are not in these events"""
+        return Events([bounds])._setop(self, 'difference')
+
+    def _shift_edges(self, dur):
+        sr = self[0].sr
+        return dur if isinstance(dur, (int, np.integer)) else int(round(dur*sr)), sr # int is samples, float is time
+
+    def dilate(self, dur):
+        """Extend every event by dur (float for time, int for samples) on both sides, and merge events that overlap"""
+        if not self:
+            return Events()
+        n, sr = self._shift_edges(dur)
+        return self._from_samples(*interval_dilate(*self._samples(), n), sr)
+
+    def erode(self, dur):
+        """Shrink every event by dur (float for time, int for samples) on both sides, and drop events that vanish"""
+        if not self:
+            return Events()
+        n, sr = self._shift_edges(dur)
+        return self._from_samples(*interval_dilate(*self._samples(), -n), sr)
+
+    def to_table(self):
+        """Columnar copy of these events for fast label queries. See EventTable."""
+        return EventTable.from_events(self)
+
+
+
+class EventTable:
+    """
+    Columnar collection of events with one sampling rate.
+    Start and end samples (both included, as in Interval) are stored as
+    arrays, and labels are indexed (label -> sorted row numbers), so that
+    label queries don't scan the events.
+        start, end - sample numbers (int arrays) or times in seconds (float arrays)
+        labels - list with a list of labels for each event
+    Example:
+        tbl = events.to_table()                         # or EventTable.from_events(events)
+        tbl.get('pitch', 'fastball')                    # events with both labels
+        tbl.get('pitch', 'warmup', how='or')            # events with either label
+        segments = tbl.get('pitch').slice_data(emg)     # list of sampled.Data views
+        tbl.to_events()                                 # back to sampled.Events
+    """
+    def __init__(self, start, end, sr=30., labels=None):
+        self.sr = float(sr)
+        self.start = self._to_samples(start)
+        self.end = self._to_samples(end)
+        assert self.start.shape == self.end.shape and self.start.ndim == 1
+        if labels is None:
+            labels = [[] for _ in range(len(self.start))]
+        assert len(labels) == len(self.start)
+        self._labels = [list(x) for x in labels]
+        index = {}
+        for row, row_labels in enumerate(self._labels):
+            for label in row_labels:
+                index.setdefault(label, []).append(row)
+        self._index = {label: np.unique(rows) for label, rows in index.items()}
+
+    def _to_samples(self, x):
+        x = np.asarray(x)
+        if x.dtype.kind == 'f': # time to sample, as in Time
+            return (x*self.sr).astype(np.int64)
+        return x.astype(np.int64)
+
+    @classmethod
+    def from_events(cls, events):
+        events = list(events)
+        if not events:
+            return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        sr = events[0].sr
+        assert all(e.sr == sr for e in events)
+        return cls([e.start.sample for e in events], [e.end.sample for e in events], sr, [getattr(e, 'labels', []) for e in events])
+
+    def to_events(self):
+        return Events(self[i] for i in range(len(self)))
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, key):
+        """An int returns a sampled.Event, and anything else (slice, row numbers, boolean mask) returns an EventTable"""
+        if isinstance(key, (int, np.integer)):
+            return Event(Time(int(self.start[key]), self.sr), Time(int(self.end[key]), self.sr), labels=list(self._labels[key]))
+        rows = np.arange(len(self))[key]
+        labels = [self._labels[i] for i in rows.tolist()]
+        if not np.all(rows[1:] > rows[:-1]):
+            return EventTable(self.start[rows], self.end[rows], self.sr, labels)
+        # sorted rows, e.g. from a query - remap the label index instead of rebuilding it
+        ret = EventTable.__new__(EventTable)
+        ret.sr, ret.start, ret.end, ret._labels, ret._index = self.sr, self.start[rows], self.end[rows], labels, {}
+        for label, label_rows in self._index.items():
+            if len(rows):
+                found = label_rows[rows[np.searchsorted(rows, label_rows).clip(max=len(rows)-1)] == label_rows]
+                if len(found):
+                    ret._index[label] = np.searchsorted(rows, found)
+        return ret
+
+    @property
+    def start_time(self):
+        return self.start/self.sr
+
+    @property
+    def end_time(self):
+        return self.end/self.sr
+
+    @property
+    def labels(self):
+        """All labels in the table"""
+        return list(self._index)
+
+    def rows(self, *labels, how='and'):
+        """Sorted row numbers of events with all (how='and') or any (how='or') of the labels"""
+        assert how in ('and', 'or')
+        empty = np.zeros(0, dtype=np.int64)
+        row_sets = [self._index.get(label, empty) for label in labels]
+        if not row_sets:
+            return np.arange(len(self))
+        ret = row_sets[0]
+        for x in row_sets[1:]:
+            ret = np.intersect1d(ret, x, assume_unique=True) if how == 'and' else np.union1d(ret, x)
+        return ret
+
+    def get(self, *labels, how='and'):
+        """Events with all (how='and') or any (how='or') of the labels"""
+        return self[self.rows(*labels, how=how)]
+
+    def _ranges(self, data):
+        """Start (inclusive) and end (exclusive) indices of each event in data, clipped to the signal"""
+        assert data.sr == self.sr
+        offset = round(data._t0*data.sr)
+        n = len(data)
+        rng_start = np.clip(self.start - offset, 0, max(n-1, 0))
+        rng_end = np.clip(self.end - offset + 1, 0, n) # +1 because events include both ends
+        return rng_start, rng_end
+
+    def slice_data(self, data):
+        """List of read-only views into data (sampled.Data) for each event, same as data.take_by_interval(event)"""
+        ret = []
+        for rng_start, rng_end, start, end in zip(*(x.tolist() for x in self._ranges(data) + (self.start, self.end))):
+            proc_sig = data._sig[_axis_slice(data._sig.ndim, data.axis, rng_start, rng_end)]
+            proc_sig.flags.writeable = False # protect the parent signal
+            his = data._history + [('slice', ('Interval', start/self.sr, end/self.sr, self.sr))]
+            seg = data.__class__(proc_sig, data.sr, data.axis, his, data._t0 + rng_start/data.sr)
+            seg._cow = data._cow = True # the parent shares its buffer with the views
+            ret.append(seg)
+        return ret
+
+    def stack(self, data):
+        """Array with the samples of data in each event (all events must be of the same length), with events along the first axis"""
+        rng_start, rng_end = self._ranges(data)
+        n_samples = rng_end - rng_start
+        assert len(self) == 0 or np.all(n_samples == n_samples[0])
+        idx = rng_start[:, np.newaxis] + np.arange(n_samples[0] if len(self) else 0)
+        return np.moveaxis(np.take(data._sig, idx, axis=data.axis), data.axis, 0) # events x (signal layout)
+
+    def __repr__(self):
+        return "EventTable(n={}, sr={} Hz, labels={})".format(len(self), self.sr, self.labels)
+
+
+class IntervalIndex:
+    """
+    Index of intervals (start and end samples, both included) for fast
+    overlap and stabbing queries. Intervals are sorted by start, and the
+    maximum end sample is kept for each node of a binary tree over the
+    sorted intervals (built level by level with array operations), so a
+    query visits O(log n + k) nodes for k results. Many queries are
+    processed together, level by level.
+    Intervals added with append go to a small pending buffer that is
+    searched directly, and merged into the tree when it grows.
+    Query results are row numbers in the order the intervals were added.
+    Example:
+        idx = IntervalIndex(burst_start, burst_end)
+        idx.stab(1520)                          # rows of bursts that include sample 1520
+        idx.overlap(1500, 1600)                 # rows of bursts overlapping samples 1500 to 1600
+        q, rows = idx.overlap_pairs(ann_start, ann_end)   # all (annotation, burst) pairs that overlap
+        start, end = idx.merge()                # union of overlapping intervals
+    """
+    def __init__(self, start=(), end=(), sr=None):
+        self.sr = sr
+        start = np.asarray(start, dtype=np.int64)
+        end = np.asarray(end, dtype=np.int64)
+        assert start.shape == end.shape and start.ndim == 1
+        self._pending_start, self._pending_end = [], []
+        self._build(start, end)
+
+    @classmethod
+    def from_events(cls, events):
+        events = list(events)
+        sr = events[0].sr if events else None
+        assert all(e.sr == sr for e in events)
+        return cls([e.start.sample for e in events], [e.end.sample for e in events], sr)
+
+    def _build(self, start, end):
+        self._n = len(start)
+        order = np.argsort(start, kind='stable')
+        self._rows = order
+        self._start = start[order]
+        self._end = end[order]
+        # tree of maximum end samples, leaves padded to a power of 2
+        n_leaves = 1 << int(np.ceil(np.log2(max(self._n, 1))))
+        level = np.full(n_leaves, np.iinfo(np.int64).min)
+        level[:self._n] = self._end
+        self._tree = [level]
+        while len(level) > 1:
+            level = np.maximum(level[0::2], level[1::2])
+            self._tree.append(level)
+
+    def __len__(self):
+        return self._n + len(self._pending_start)
+
+    def append(self, start, end):
+        self._pending_start.append(int(start))
+        self._pending_end.append(int(end))
+        if len(self._pending_start) > max(256, int(np.sqrt(self._n))): # amortized rebuild
+            self.flush()
+
+    def flush(self):
+        """Merge the pending intervals into the tree"""
+        if self._pending_start:
+            start, end = self.intervals()
+            self._pending_start, self._pending_end = [], []
+            self._build(start, end)
+
+    def intervals(self):
+        """Start and end samples in the order they were added"""
+        start = np.empty(self._n, dtype=np.int64)
+        end = np.empty(self._n, dtype=np.int64)
+        start[self._rows], end[self._rows] = self._start, self._end
+        return np.r_[start, np.asarray(self._pending_start, dtype=np.int64)], np.r_[end, np.asarray(self._pending_end, dtype=np.int64)]
+
+    def _search(self, n_before, min_end):
+        """
+        For each query q, sorted positions p < n_before[q] with end[p] >= min_end[q].
+        Returns (query number, sorted position) pairs.
+        """
+        q = np.arange(len(n_before))
+        node = np.zeros(len(n_before), dtype=np.int64)
+        for depth in range(len(self._tree)-1, -1, -1):
+            level = self._tree[depth]
+            keep = (level[node] >= min_end[q]) & ((node << depth) < n_before[q]) # subtree has a long enough interval that starts early enough
+            q, node = q[keep], node[keep]
+            if depth > 0:
+                q, node = np.repeat(q, 2), (np.repeat(node, 2) << 1) + np.tile([0, 1], len(node))
+        return q, node
+
+    def overlap_pairs(self, start, end):
+        """All (query number, row) pairs where interval row overlaps the query from start to end (inclusive)."""
+        start = np.atleast_1d(np.asarray(start, dtype=np.int64))
+        end = np.atleast_1d(np.asarray(end, dtype=np.int64))
+        q, pos = self._search(np.searchsorted(self._start, end, side='right'), start)
+        rows = self._rows[pos]
+        if self._pending_start: # small buffer, checked directly
+            p_start, p_end = np.asarray(self._pending_start), np.asarray(self._pending_end)
+            pq, prow = np.nonzero((p_start <= end[:, np.newaxis]) & (p_end >= start[:, np.newaxis]))
+            q, rows = np.r_[q, pq], np.r_[rows, self._n + prow]
+        order = np.lexsort((rows, q))
+        return q[order], rows[order]
+
+    def overlap(self, start, end):
+        """Sorted rows of intervals that overlap the samples from start to end (inclusive)."""
+        return self.overlap_pairs(start, end)[1]
+
+    def stab(self, sample):
+        """Sorted rows of intervals that include sample."""
+        return self.overlap_pairs(sample, sample)[1]
+
+    def containing(self, start, end):
+        """Sorted rows of intervals that contain all samples from start to end."""
+        start, end = np.atleast_1d(np.int64(start)), np.atleast_1d(np.int64(end))
+        _, pos = self._search(np.searchsorted(self._start, start, side='right'), end)
+        rows = self._rows[pos]
+        if self._pending_start:
+            p_start, p_end = np.asarray(self._pending_start), np.asarray(self._pending_end)
+            rows = np.r_[rows, self._n + np.flatnonzero((p_start <= start) & (p_end >= end))]
+        return np.sort(rows)
+
+    def within(self, start, end):
+        """Sorted rows of intervals that lie between start and end."""
+        lo, hi = np.searchsorted(self._start, [start, end], side='left'), np.searchsorted(self._start, end, side='right')
+        pos = np.arange(lo[0], hi)
+        rows = self._rows[pos[self._end[pos] <= end]]
+        if self._pending_start:
+            p_start, p_end = np.asarray(self._pending_start), np.asarray(self._pending_end)
+            rows = np.r_[rows, self._n + np.flatnonzero((p_start >= start) & (p_end <= end))]
+        return np.sort(rows)
+
+    def merge(self):
+        """Start and end samples of the union of overlapping intervals, sorted by start (O(n log n))."""
+        start, end = self.intervals()
+        order = np.argsort(start, kind='stable')
+        start, end = start[order], end[order]
+        if len(start) == 0:
+            return start, end
+        running_end = np.maximum.accumulate(end)
+        new_group = np.r_[True, start[1:] > running_end[:-1]]
+        group_start = np.flatnonzero(new_group)
+        group_last = np.r_[group_start[1:] - 1, len(start) - 1]
+        return start[group_start], running_end[group_last]
+
 
 class RunningWin:
     def __init__(self, n_samples, win_size, win_inc=1, step=None, offset=0):
@@ -792,6 +2481,269 @@ class Siglets:
         return (len(set([ev.dur_sample for ev in self.events])) == 1) # if all events are of the same size
 
 
+def running_reduce(sig, reducer, win_size, win_inc=1, axis=0, threshold=None):
+    """
+    Running window reductions in O(N) for all channels at once.
+        sig - 1D or 2D numpy array
+        reducer - 'mean', 'rms', 'var', 'min', 'max', or 'count_above'
+        win_size, win_inc - window size and increment in samples
+        threshold - used with count_above
+    Sums are computed from cumulative sums, and min/max use the van
+    Herk/Gil-Werman algorithm. Windows containing NaN return NaN (count_above ignores NaN).
+    Returns an array with one value per window (along axis) and channel.
+    """
+    assert reducer in ('mean', 'rms', 'var', 'min', 'max', 'count_above')
+    sig = np.moveaxis(np.asarray(sig), axis, -1) # time is the last axis
+    n_samples = sig.shape[-1]
+    n_win = (n_samples - win_size)//win_inc + 1
+    starts = np.arange(n_win)*win_inc
+
+    def window_sum(x):
+        csum = np.zeros(x.shape[:-1] + (n_samples+1,), dtype=np.int64 if x.dtype == np.int64 else np.float64)
+        np.cumsum(x, axis=-1, out=csum[..., 1:])
+        return csum[..., starts+win_size] - csum[..., starts]
+
+    if reducer == 'count_above':
+        assert threshold is not None
+        ret = window_sum((sig > threshold).astype(np.int64))
+    elif reducer in ('min', 'max'):
+        acc = np.maximum if reducer == 'max' else np.minimum
+        n_blocks = -(-n_samples // win_size)
+        fill = -np.inf if reducer == 'max' else np.inf
+        padded = np.full(sig.shape[:-1] + (n_blocks*win_size,), fill, dtype=np.result_type(sig.dtype, np.float64))
+        padded[..., :n_samples] = sig
+        blocks = padded.reshape(sig.shape[:-1] + (n_blocks, win_size))
+        prefix = acc.accumulate(blocks, axis=-1).reshape(padded.shape)
+        suffix = np.flip(acc.accumulate(np.flip(blocks, axis=-1), axis=-1), axis=-1).reshape(padded.shape)
+        ret = acc(suffix[..., starts], prefix[..., starts+win_size-1])
+    else:
+        nans = np.isnan(sig)
+        if reducer == 'rms':
+            ret = np.sqrt(window_sum(np.where(nans, 0., sig)**2)/win_size)
+        else:
+            sig_mean = np.nanmean(sig, axis=-1, keepdims=True)
+            x = np.where(nans, 0., sig - sig_mean) # centering reduces round-off in the cumulative sums
+            mean = window_sum(x)/win_size
+            if reducer == 'mean':
+                ret = mean + sig_mean
+            else:
+                ret = np.maximum(window_sum(x**2)/win_size - mean**2, 0.)
+        if nans.any():
+            ret[window_sum(nans.astype(np.int64)) > 0] = np.nan
+    return np.moveaxis(ret, -1, axis)
+
+def _apply_with_axis(func, sig, axis, args, kwargs):
+    """Call func with the axis keyword argument if it accepts it. Returns the result, and the keyword arguments that were used."""
+    kwargs = dict(kwargs)
+    try:
+        kwargs['axis'] = axis
+        proc_sig = func(sig, *args, **kwargs)
+    except TypeError:
+        kwargs.pop('axis')
+        proc_sig = func(sig, *args, **kwargs)
+    return proc_sig, kwargs
+
+def _apply_to_rows(rows, func, axis, args, kwargs):
+    """Data.apply on a group of channels (rows are channels x time). The result is in the layout returned by func."""
+    proc_sig, kwargs = _apply_with_axis(func, np.moveaxis(rows, -1, axis), axis, args, kwargs)
+    return np.asarray(proc_sig), kwargs, len(rows)
+
+def _call_rows(rows, start, stop, func, per_row, args, kwargs):
+    if per_row:
+        return [np.array(func(row, *args, **kwargs)) for row in rows[start:stop]]
+    return func(rows[start:stop], *args, **kwargs)
+
+def _call_shared_rows(shm_name, shape, dtype, start, stop, func, per_row, args, kwargs):
+    """Worker process: attach to the shared signal, and process rows start to stop"""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        rows = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        ret = _call_rows(rows, start, stop, func, per_row, args, kwargs)
+        if not per_row: # don't return views into shared memory
+            ret = tuple(np.array(r) if isinstance(r, np.ndarray) else r for r in ret) if isinstance(ret, tuple) else np.array(ret)
+        del rows
+    finally:
+        shm.close()
+    return ret
+
+def _map_rows(func, rows, per_row, args=(), kwargs=None):
+    """
+    Split rows (2D array, channels x time) into contiguous groups, one per
+    worker, and process them in a thread or process pool (see parallel).
+    func(row, *args, **kwargs) for each row if per_row, otherwise func(group_of_rows, *args, **kwargs).
+    Returns a list with the result of each group.
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    kwargs = {} if kwargs is None else kwargs
+    n_workers = min(PARALLEL['n_workers'], len(rows))
+    bounds = np.linspace(0, len(rows), n_workers+1).astype(int)
+    if PARALLEL['backend'] == 'thread':
+        with ThreadPoolExecutor(n_workers) as pool:
+            futures = [pool.submit(_call_rows, rows, start, stop, func, per_row, args, kwargs) for start, stop in zip(bounds[:-1], bounds[1:])]
+            return [f.result() for f in futures]
+    
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create=True, size=max(rows.nbytes, 1))
+    try:
+        shared_rows = np.ndarray(rows.shape, dtype=rows.dtype, buffer=shm.buf)
+        shared_rows[:] = rows
+        del shared_rows
+        with ProcessPoolExecutor(n_workers) as pool:
+            futures = [pool.submit(_call_shared_rows, shm.name, rows.shape, rows.dtype, start, stop, func, per_row, args, kwargs) for start, stop in zip(bounds[:-1], bounds[1:])]
+            return [f.result() for f in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+def apply_along_axis(func, axis, arr, *args, **kwargs):
+    """
+    Same as numpy.apply_along_axis for functions that return a scalar
+    or a 1D array, but channels are processed in a pool of workers when
+    enabled (see parallel).
+    """
+    arr = np.asarray(arr)
+    if PARALLEL['n_workers'] == 1 or arr.ndim == 1:
+        return np.apply_along_axis(func, axis, arr, *args, **kwargs)
+    rows = np.moveaxis(arr, axis, -1)
+    other_shape = rows.shape[:-1]
+    rows = rows.reshape(-1, rows.shape[-1])
+    results = [r for group in _map_rows(func, rows, True, args, kwargs) for r in group]
+    ret = np.stack(results).reshape(other_shape + results[0].shape)
+    if results[0].ndim == 1:
+        ret = np.moveaxis(ret, -1, axis)
+    return ret
+
+def analytic_signal(sig, axis=-1, workers=None, pad_fast_len=None):
+    """
+    Analytic signal of a real signal, same as scipy.signal.hilbert.
+    The transforms use multiple threads (FFT_WORKERS by default).
+    pad_fast_len - zero-pad the signal to a fast FFT length (next_fast_len).
+        This is faster for some lengths, but the result is no longer the
+        same as hilbert (especially near the ends of the signal).
+        FFT_PAD_FAST_LEN by default, which is also used by Data.envelope, Data.phase, etc.
+    """
+    if workers is None:
+        workers = FFT_WORKERS
+    if pad_fast_len is None:
+        pad_fast_len = FFT_PAD_FAST_LEN
+    sig = np.asarray(sig)
+    assert not np.iscomplexobj(sig)
+    n_samples = sig.shape[axis]
+    n_fft = next_fast_len(n_samples, real=True) if pad_fast_len else n_samples
+    spec = sp_fft.rfft(sig, n_fft, axis=axis, workers=workers)
+    h = np.full(spec.shape[axis], 2.)
+    h[0] = 1.
+    if n_fft % 2 == 0:
+        h[-1] = 1. # Nyquist
+    h_shape = [1]*sig.ndim
+    h_shape[axis] = len(h)
+    spec *= h.reshape(h_shape)
+    full_shape = list(sig.shape)
+    full_shape[axis] = n_fft
+    full_spec = np.zeros(full_shape, dtype=spec.dtype) # negative frequencies are zero
+    full_spec[_axis_slice(sig.ndim, axis, 0, spec.shape[axis])] = spec
+    del spec
+    ret = sp_fft.ifft(full_spec, axis=axis, overwrite_x=True, workers=workers)
+    return ret[_axis_slice(sig.ndim, axis, 0, n_samples)]
+
+def running_median(sig, order, axis=0, mode='keep'):
+    """
+    Running median of each channel with an odd kernel of order samples.
+    Uses scipy.ndimage's 1D rank filter, which keeps a double heap of
+    the samples in the window (O(N log k)).
+        mode - 'keep' leaves the first and last order//2 samples unfiltered.
+            Other values are passed to scipy.ndimage.median_filter ('reflect', 'nearest', 'mirror', 'constant', 'wrap').
+    Windows containing NaN values return NaN.
+    """
+    assert order % 2 == 1
+    half = order//2
+    sig = np.asarray(sig)
+    proc_sig = np.empty_like(sig)
+    sig_t = np.moveaxis(sig, axis, -1) # time is the last axis
+    proc_sig_t = np.moveaxis(proc_sig, axis, -1)
+    for ch in np.ndindex(sig_t.shape[:-1]):
+        x = sig_t[ch]
+        nans = np.isnan(x) if x.dtype.kind in 'fc' else None
+        if nans is not None and nans.any():
+            x = np.where(nans, 0, x)
+        proc = ndimage.median_filter(x, size=order, mode='nearest' if mode == 'keep' else mode)
+        if nans is not None and nans.any():
+            proc[ndimage.maximum_filter1d(nans, order, mode='constant', cval=False)] = np.nan
+        if mode == 'keep': # ends of the signal are not filtered
+            proc[:half] = sig_t[ch][:half]
+            proc[len(proc)-half:] = sig_t[ch][len(proc)-half:]
+        proc_sig_t[ch] = proc
+    return proc_sig
+
+def _catmull_rom_weights(frac):
+    """Weights of the four samples around a fractional position (0 <= frac < 1) for cubic (Catmull-Rom) interpolation"""
+    f2, f3 = frac**2, frac**3
+    return ((-f3 + 2*f2 - frac)/2., (3*f3 - 5*f2 + 2.)/2., (-3*f3 + 4*f2 + frac)/2., (f3 - f2)/2.)
+
+def _axis_slice(ndim, axis, start, stop):
+    """Index to slice an array between start and stop along axis"""
+    slc = [slice(None)]*ndim
+    slc[axis] = slice(start, stop)
+    return tuple(slc)
+
+def _impulse_len(sos, tol=1e-9):
+    """Number of samples after which the impulse response of an IIR filter (second-order sections) decays below tol of its peak"""
+    n = 256
+    while True:
+        impulse = np.zeros(n)
+        impulse[0] = 1.
+        h = np.abs(sosfilt(sos, impulse))
+        above = np.flatnonzero(h > tol*h.max())
+        if above[-1] < n//2 or n >= 2**26:
+            return int(above[-1]) + 1
+        n *= 2
+
+def rational_ratio(new_sr, sr, max_term=1000):
+    """
+    Express new_sr/sr as up/down with small integers, e.g. (9, 100) for 2000 Hz -> 180 Hz.
+    Returns None if up or down would be larger than max_term.
+    """
+    ratio = Fraction(new_sr).limit_denominator(10**6) / Fraction(sr).limit_denominator(10**6)
+    if max(ratio.numerator, ratio.denominator) > max_term:
+        return None
+    return ratio.numerator, ratio.denominator
+
+def sosfiltfilt_finite(sos, sig, axis=-1):
+    """
+    Zero-phase filtering with second-order sections that preserves
+    float32 signals (float64 otherwise), and filters each finite stretch
+    of a signal separately. Non-finite values (NaN gaps) are left in
+    place, and stretches that are too short for the default padding are
+    filtered with a reduced padlen.
+        sos - second-order sections, e.g. from filter_cache.butter
+        sig - 1D or 2D numpy array
+    """
+    dtype = sig.dtype if sig.dtype in (np.float32, np.float64) else np.dtype(np.float64)
+    sos = np.asarray(sos, dtype=dtype)
+    finite = np.isfinite(sig)
+    if finite.all():
+        return sosfiltfilt(sos, sig.astype(dtype, copy=False), axis=axis)
+    
+    sig_t = np.moveaxis(sig, axis, -1) # time is the last axis
+    finite_t = np.moveaxis(finite, axis, -1)
+    proc_sig = np.array(sig_t, dtype=dtype) # non-finite values are retained
+    if sig_t.ndim == 1:
+        sig_t, finite_t, proc_sig_ch = sig_t[None, :], finite_t[None, :], proc_sig[None, :]
+    else:
+        proc_sig_ch = proc_sig
+    
+    all_finite = finite_t.all(axis=-1)
+    if all_finite.any():
+        proc_sig_ch[all_finite] = sosfiltfilt(sos, proc_sig_ch[all_finite], axis=-1)
+    default_padlen = 3*(2*len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum()))
+    for ch in np.flatnonzero(~all_finite):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], finite_t[ch].view(np.int8), [0]))))
+        for run_start, run_stop in zip(edges[::2], edges[1::2]):
+            padlen = min(default_padlen, run_stop - run_start - 1)
+            proc_sig_ch[ch, run_start:run_stop] = sosfiltfilt(sos, proc_sig_ch[ch, run_start:run_stop], padlen=padlen)
+    return np.moveaxis(proc_sig, -1, axis)
+
 def interpnan(sig, maxgap=None, min_data_frac=0.2, **kwargs):
     """
     Interpolate NaNs in a 1D signal
@@ -806,6 +2758,8 @@ def interpnan(sig, maxgap=None, min_data_frac=0.2, **kwargs):
     """
     assert np.ndim(sig) == 1
     assert 0. <= min_data_frac <= 1.
+    if _interpnan_vectorizable(kwargs):
+        return interpnan_nd(sig, 0, maxgap, min_data_frac, **kwargs)
     if 'fill_value' not in kwargs:
         kwargs['fill_value'] = 'extrapolate'
         
@@ -832,46 +2786,275 @@ def interpnan(sig, maxgap=None, min_data_frac=0.2, **kwargs):
     proc_sig[nans & mask]= interp1d(x(~nans), proc_sig[~nans], **kwargs)(x(nans & mask)) # np.interp(x(nans & mask), x(~nans), proc_sig[~nans])
     return proc_sig
 
-def onoff_samples(tfsig):
+def _interpnan_vectorizable(kwargs):
+    """Check if the interp1d kwargs supplied to interpnan are supported by interpnan_nd"""
+    return kwargs.get('kind', 'linear') in ('linear', 'nearest') and kwargs.get('fill_value', 'extrapolate') == 'extrapolate' and set(kwargs) <= {'kind', 'fill_value', 'min_data_frac'}
+
+def interpnan_nd(sig, axis=0, maxgap=None, min_data_frac=0.2, kind='linear', fill_value='extrapolate'):
+    """
+    Interpolate NaNs in all channels of a 1D or 2D signal at once.
+    Equivalent to interpnan with linear or nearest interpolation, and
+    extrapolation at the ends (using the two nearest values for linear).
+        maxgap - 
+            - (NoneType) all NaN values will be interpolated
+            - (int) stretches of NaN values smaller than or equal to maxgap will be interpolated
+            - (boolean array) interpolation will only happen where maxgap is True.
+                Either the same shape as sig, or a 1D array along the time axis for all channels.
+        min_data_frac - channels with a smaller fraction of finite values are left unchanged
+    NaN runs of every channel are found at once from the edges of the
+    NaN mask, and the fill values are computed with array operations.
+    """
+    assert kind in ('linear', 'nearest') and fill_value == 'extrapolate'
+    assert 0. <= min_data_frac <= 1.
+    sig = np.asarray(sig)
+    proc_sig = sig.astype(sig.dtype if sig.dtype.kind == 'f' else np.float64) # copy
+    proc_rows = np.moveaxis(proc_sig, axis, -1)
+    proc_rows = proc_rows.reshape(-1, proc_rows.shape[-1]) # channels x time, view into proc_sig
+    n_ch, n_samples = proc_rows.shape
+    nans = np.isnan(proc_rows)
+
+    # NaN runs [run_start, run_end) of all channels, sorted by channel and time
+    edges = np.diff(np.pad(nans, ((0, 0), (1, 1))).view(np.int8), axis=-1)
+    run_ch, run_start = np.nonzero(edges == 1)
+    run_end = np.nonzero(edges == -1)[1]
+    n_valid = n_samples - np.bincount(run_ch, weights=run_end-run_start, minlength=n_ch)
+    keep = (n_valid > 0) & (n_valid/n_samples >= min_data_frac)
+    if isinstance(maxgap, int):
+        keep = keep[run_ch] & (run_end - run_start <= maxgap)
+    else:
+        keep = keep[run_ch]
+
+    # valid samples around each run (-1 or n_samples if there is none)
+    prev_t, next_t = run_start - 1, np.where(run_end < n_samples, run_end, n_samples)
+    same_ch_next = np.r_[run_ch[1:] == run_ch[:-1], False]
+    same_ch_prev = np.r_[False, run_ch[1:] == run_ch[:-1]]
+    # second valid sample after the run (for leading runs), and before the run (for trailing runs)
+    after_next = np.where(same_ch_next & (np.r_[run_start[1:], 0] == next_t + 1), np.r_[run_end[1:], 0], next_t + 1)
+    before_prev = np.where(same_ch_prev & (np.r_[0, run_end[:-1]] == prev_t), np.r_[0, run_start[:-1]] - 1, prev_t - 1)
+
+    # expand runs into samples
+    sel = np.flatnonzero(keep)
+    run_len = (run_end - run_start)[sel]
+    run_idx = np.repeat(sel, run_len)
+    t = run_start[run_idx] + np.arange(run_len.sum()) - np.repeat(np.cumsum(run_len) - run_len, run_len)
+    ch = run_ch[run_idx]
+    if maxgap is not None and not isinstance(maxgap, int):
+        if np.ndim(maxgap) == sig.ndim:
+            mask = np.moveaxis(np.asarray(maxgap, dtype=bool), axis, -1).reshape(n_ch, n_samples)[ch, t]
+        else: # same mask for all channels
+            mask = np.asarray(maxgap, dtype=bool)[t]
+        run_idx, t, ch = run_idx[mask], t[mask], ch[mask]
+    prev_t, next_t = prev_t[run_idx], next_t[run_idx]
+
+    if kind == 'nearest': # ties go to the previous sample, like interp1d
+        use_next = (prev_t < 0) | ((next_t < n_samples) & (next_t - t < t - prev_t))
+        vals = proc_rows[ch, np.where(use_next, next_t, prev_t)]
+    else:
+        leading, trailing = prev_t < 0, next_t >= n_samples
+        k0 = np.where(leading, next_t, np.where(trailing, before_prev[run_idx], prev_t))
+        k1 = np.where(leading, after_next[run_idx], np.where(trailing, prev_t, next_t))
+        single = (k0 < 0) | (k1 >= n_samples) # only one valid sample in the channel
+        k0 = np.where(single, np.where(leading, next_t, prev_t), k0)
+        k1 = np.where(single, k0 + 1, k1)
+        x0, x1 = proc_rows[ch, k0], proc_rows[ch, np.minimum(k1, n_samples-1)]
+        vals = np.where(single, x0, x0 + (x1 - x0)*(t - k0)/(k1 - k0))
+    proc_rows[ch, t] = vals
+    return proc_sig
+
+def _half_open(start, end):
+    """Sorted, disjoint half-open ranges [start, stop) covering the same samples as intervals with inclusive ends"""
+    start, end = np.asarray(start, dtype=np.int64), np.asarray(end, dtype=np.int64)
+    keep = end >= start
+    start, stop = start[keep], end[keep] + 1
+    if len(start) == 0:
+        return start, stop
+    order = np.argsort(start, kind='stable')
+    start, stop = start[order], stop[order]
+    running_stop = np.maximum.accumulate(stop)
+    new_group = np.r_[True, start[1:] > running_stop[:-1]] # touching ranges are merged
+    return start[new_group], running_stop[np.r_[np.flatnonzero(new_group)[1:] - 1, len(start) - 1]]
+
+def interval_setop(a_start, a_end, b_start, b_end, how='union'):
+    """
+    Set operations on the samples covered by two collections of intervals
+    (start and end samples, both included, in any order, may overlap).
+        how - 'union', 'intersection', 'difference' (in a but not in b), or 'symmetric_difference'
+    Returns sorted start and end samples (both included) of disjoint intervals.
+    Both collections are converted to half-open ranges, and one sweep over
+    all the boundaries gives the coverage of each collection between them.
+    """
+    ops = {'union': np.logical_or, 'intersection': np.logical_and, 'difference': lambda a, b: a & ~b, 'symmetric_difference': np.logical_xor}
+    a_start, a_stop = _half_open(a_start, a_end)
+    b_start, b_stop = _half_open(b_start, b_end)
+    bounds = np.concatenate((a_start, a_stop, b_start, b_stop))
+    if len(bounds) == 0:
+        return bounds, bounds.copy()
+    na, nb = len(a_start), len(b_start)
+    delta_a = np.concatenate((np.ones(na, dtype=np.int64), -np.ones(na, dtype=np.int64), np.zeros(2*nb, dtype=np.int64)))
+    delta_b = np.concatenate((np.zeros(2*na, dtype=np.int64), np.ones(nb, dtype=np.int64), -np.ones(nb, dtype=np.int64)))
+    order = np.argsort(bounds, kind='stable')
+    bounds, in_a, in_b = bounds[order], np.cumsum(delta_a[order]), np.cumsum(delta_b[order])
+    last = np.r_[bounds[1:] != bounds[:-1], True] # coverage after all changes at a boundary
+    bounds, in_a, in_b = bounds[last], in_a[last] > 0, in_b[last] > 0
+    inside = ops[how](in_a, in_b).astype(np.int8) # coverage from each boundary to the next
+    edges = np.diff(np.r_[np.int8(0), inside])
+    return bounds[edges == 1], bounds[edges == -1] - 1
+
+def interval_complement(start, end, lo, hi):
+    """Samples from lo to hi (both included) that are not in any interval"""
+    return interval_setop([lo], [hi], start, end, how='difference')
+
+def interval_dilate(start, end, n):
+    """Extend intervals by n samples on both sides (shrink if n is negative), and merge the intervals that overlap"""
+    start, stop = _half_open(start, end) # erode the union of the intervals, not each interval
+    start, stop = _half_open(start - n, stop - 1 + n)
+    return start, stop - 1
+
+def onoff_samples(tfsig, axis=-1, n_samples=None):
     """
-    Find onset and offset samples of a 1D boolean signal (e.g. Thresholded TTL pulse)
-    Currently works only on 1D signals!
+    Find onset and offset samples of a boolean signal (e.g. Thresholded TTL pulse)
     tfsig is shorthand for true/false signal
+    Onsets are the first True sample of each run, offsets the first False
+    sample after it, except for a run that lasts till the end of the signal,
+    whose offset is the last sample.
+    For 1D signals, returns two arrays (onset_samples, offset_samples).
+    For 2D signals, returns two lists with one array per channel, with time along axis.
+    Bit-packed input (np.packbits of a 1D boolean signal) is supported by
+    specifying the number of samples in the unpacked signal with n_samples.
     """
+    if n_samples is not None:
+        return _onoff_samples_packed(np.asarray(tfsig), n_samples)
+    tfsig = np.asarray(tfsig)
     assert tfsig.dtype == bool
-    assert np.sum(np.asarray(np.shape(tfsig)) > 1) == 1
-    x = np.squeeze(tfsig).astype(int)
-    onset_samples = list(np.where(np.diff(x) == 1)[0] + 1)
-    offset_samples = list(np.where(np.diff(x) == -1)[0] + 1)
-    if tfsig[0]: # is True
-        onset_samples = [0] + onset_samples
-    if tfsig[-1]:
-        offset_samples = offset_samples + [len(tfsig)-1]
-    return onset_samples, offset_samples
-
-def uniform_resample(time, sig, sr, t_min=None, t_max=None):
+    if tfsig.ndim == 1:
+        (onset_samples,), (offset_samples,) = _onoff_samples_rows(tfsig[np.newaxis, :])
+        return onset_samples, offset_samples
+    assert tfsig.ndim == 2
+    return _onoff_samples_rows(np.moveaxis(tfsig, axis, -1))
+
+def _onoff_samples_rows(rows):
+    """Onset and offset samples of each row of a 2D boolean array (channels x time)"""
+    n_ch, n = rows.shape
+    edges = rows != np.pad(rows, ((0, 0), (1, 0)))[:, :-1] # sample differs from the previous one (False before the start)
+    ch, t = np.nonzero(edges)
+    is_onset = rows[ch, t]
+    on_ch, onsets = ch[is_onset], t[is_onset]
+    off_ch, offsets = ch[~is_onset], t[~is_onset]
+    if n > 0: # runs lasting till the end of the signal
+        trailing = np.flatnonzero(rows[:, -1])
+        off_ch = np.r_[off_ch, trailing]
+        offsets = np.r_[offsets, np.full(len(trailing), n-1)]
+        order = np.argsort(off_ch, kind='stable')
+        off_ch, offsets = off_ch[order], offsets[order]
+    split = np.arange(1, n_ch)
+    return np.split(onsets, np.searchsorted(on_ch, split)), np.split(offsets, np.searchsorted(off_ch, split))
+
+def _onoff_samples_packed(packed, n_samples):
+    """
+    Onset and offset samples of a bit-packed 1D boolean signal (big bit order, as in np.packbits).
+    Each byte is compared with itself shifted by one sample, and only bytes containing an edge are unpacked.
+    """
+    assert packed.dtype == np.uint8 and packed.ndim == 1
+    assert len(packed) == -(-n_samples//8)
+    prev_byte = np.r_[np.uint8(0), packed[:-1]]
+    edge_bytes = packed ^ ((packed >> 1) | (prev_byte << 7)) # bits that differ from the previous sample
+    idx = np.flatnonzero(edge_bytes)
+    edge_bits = np.unpackbits(edge_bytes[idx]).reshape(-1, 8).astype(bool)
+    t = (idx[:, np.newaxis]*8 + np.arange(8))[edge_bits]
+    is_onset = np.unpackbits(packed[idx]).reshape(-1, 8).astype(bool)[edge_bits]
+    in_range = t < n_samples # ignore the padding bits
+    t, is_onset = t[in_range], is_onset[in_range]
+    onsets, offsets = t[is_onset], t[~is_onset]
+    if n_samples > 0 and packed[(n_samples-1)//8] & (0x80 >> ((n_samples-1) % 8)):
+        offsets = np.r_[offsets, n_samples-1]
+    return onsets, offsets
+
+class ResamplePlan:
+    """
+    Precomputed interpolation from irregular timestamps onto a uniform time
+    grid at sampling rate sr. The bracketing samples and their weights are
+    computed once from the timestamps, and the plan can be applied to any
+    number of signals (1D, or 2D with many channels) recorded with the same
+    timestamps. Values outside the range of time are held constant, as in np.interp.
+        kind -
+            'nearest'
+            'linear'
+            'cubic' - cubic Hermite with Catmull-Rom tangents computed for non-uniform spacing
+    Example:
+        plan = sampled.ResamplePlan(imu_time, sr=200, kind='cubic')
+        acc = plan(acc_sig)     # (n_samples, n_channels) -> sampled.Data
+        gyr = plan(gyr_sig)
+    """
+    def __init__(self, time, sr, t_min=None, t_max=None, kind='linear'):
+        assert kind in ('nearest', 'linear', 'cubic')
+        time = np.asarray(time, dtype=float)
+        assert time.ndim == 1 and len(time) > 1
+        assert np.all(np.diff(time) >= 0) # non-decreasing
+        if t_min is None: t_min = time[0]
+        if t_max is None: t_max = time[-1]
+
+        n_samples = int((t_max - t_min)*sr) + 1
+        t_max = t_min + (n_samples-1)/sr
+        t_proc = np.linspace(t_min, t_max, n_samples)
+
+        n = len(time)
+        k = np.clip(np.searchsorted(time, t_proc, side='right') - 1, 0, n-2)
+        h = time[k+1] - time[k]
+        frac = np.clip(np.divide(t_proc - time[k], h, out=np.zeros(n_samples), where=h > 0), 0., 1.)
+        if kind == 'nearest':
+            indices = np.where(frac > 0.5, k+1, k)[:, np.newaxis]
+            weights = np.ones((n_samples, 1))
+        elif kind == 'linear':
+            indices = np.stack((k, k+1), axis=-1)
+            weights = np.stack((1.-frac, frac), axis=-1)
+        else:
+            f2, f3 = frac**2, frac**3
+            h00, h10, h01, h11 = 2*f3 - 3*f2 + 1, f3 - 2*f2 + frac, -2*f3 + 3*f2, f3 - f2
+            km1, kp2 = np.maximum(k-1, 0), np.minimum(k+2, n-1) # one-sided tangents at the ends
+            d0, d1 = time[k+1] - time[km1], time[kp2] - time[k] # tangent spans at k and k+1
+            c0 = np.divide(h10*h, d0, out=np.zeros(n_samples), where=d0 > 0)
+            c1 = np.divide(h11*h, d1, out=np.zeros(n_samples), where=d1 > 0)
+            indices = np.stack((km1, k, k+1, kp2), axis=-1)
+            weights = np.stack((-c0, h00 - c1, h01 + c0, c1), axis=-1)
+        self.time = time
+        self.sr = sr
+        self.t0 = t_min
+        self.kind = kind
+        self.indices = indices
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __call__(self, sig, axis=None):
+        """Resample sig (time along axis, by default the axis matching the length of time) and return a sampled.Data object"""
+        sig = np.asarray(sig)
+        assert sig.ndim in (1, 2)
+        if axis is None:
+            axis = 0 if sig.shape[0] == len(self.time) else 1
+        assert sig.shape[axis] == len(self.time)
+        sig_rows = np.moveaxis(sig, axis, 0)
+        w = self.weights.reshape(self.weights.shape + (1,)*(sig.ndim-1))
+        sig_proc = np.zeros((len(self),) + sig_rows.shape[1:])
+        for j in range(self.indices.shape[1]):
+            sig_proc += w[:, j] * sig_rows[self.indices[:, j]]
+        return Data(np.moveaxis(sig_proc, 0, axis), self.sr, axis=axis, t0=self.t0)
+
+def uniform_resample(time, sig, sr, t_min=None, t_max=None, kind='linear', axis=None):
     """
     Uniformly resample a signal at a given sampling rate sr.
     Ideally the sampling rate is determined by the smallest spacing of
     time points.
     Inputs:
         time (list, 1d numpy array) is a non-decreasing array
-        sig (list, 1d numpy array)
+        sig (list, 1d or 2d numpy array) with time along axis
         sr (float) sampling rate in Hz
         t_min (float) start time for the output array
         t_max (float) end time for the output array
+        kind (str) 'linear', 'nearest' or 'cubic'
     Returns:
         pn.sampled.Data
+    To resample many signals with the same timestamps, make a ResamplePlan once and reuse it.
     """
-    assert len(time) == len(sig)
-    assert np.ndim(sig) == 1
-
-    if t_min is None: t_min = time[0]
-    if t_max is None: t_max = time[-1]
-
-    n_samples = int((t_max - t_min)*sr) + 1
-    t_max = t_min + (n_samples-1)/sr
-
-    t_proc = np.linspace(t_min, t_max, n_samples)
-    sig_proc = np.interp(t_proc, time, sig)
-    return Data(sig_proc, sr, t0=t_min)
+    assert len(time) in np.shape(sig)
+    return ResamplePlan(time, sr, t_min, t_max, kind)(sig, axis)
@@ -13,6 +13,7 @@ if DEV_ROOT not in sys.path:
     sys.path.append(DEV_ROOT)
 
 import pntools as pn
+from pntools import sampled
 
 def test_broadcasting():
     """Expected output: I 2 received 6"""
@@ -223,6 +224,439 @@ def testTrackerQuery():
     res = behavior.query("len(k.agent) > 4 and k.accuracy >= 0.3", keys=[])
     print('testTrackerQuery finished.')
 
+def test_lazy_pipeline():
+    """Lazy pipelines should give the same result and history as running the operations right away"""
+    x = sampled.Data(np.random.randn(4000, 3), sr=2000)
+    lazy_env = x.lazy().bandpass(20, 450).envelope().shift_baseline(0.1).scale(2.)
+    assert [op[0] for op in lazy_env.pending] == ['bandpass', 'envelope', 'shift_baseline', 'scale']
+    assert (lazy_env.sr, lazy_env.axis, lazy_env._t0, len(lazy_env)) == (2000, 0, 0., 4000)
+    lazy_slice = x.lazy().shift_left(-1.).take_by_interval(sampled.Interval(1.5, 2., sr=2000)).resample(1000)
+    assert (lazy_slice.sr, lazy_slice._t0) == (1000, 1.5)
+    assert lazy_env._result is None and lazy_slice._result is None # metadata doesn't run the pipeline
+    env = x.bandpass(20, 450).envelope().shift_baseline(0.1).scale(2.)
+    assert np.allclose(lazy_env(), env())
+    assert lazy_env._history == env._history
+    assert lazy_slice._t0 == lazy_slice.compute()._t0 and len(lazy_slice) == len(lazy_slice.compute())
+    assert np.array_equal((x.lazy().scale(2.) > 0.5)(), (x.scale(2.) > 0.5)())
+    assert len(x.lazy().instantaneous_frequency()) == len(x.instantaneous_frequency()) == 3999
+    lazy_apply = x.lazy().shift_left(-1.).apply(lambda s, axis: s[::2])
+    assert len(lazy_apply) == 2000 and lazy_apply._t0 == 1. and lazy_apply.axis == 0
+    lazy_mag = x.lazy().shift_left(-1.).magnitude()
+    assert (lazy_mag.axis, lazy_mag._t0, len(lazy_mag)) == (0, 0., 4000)
+    assert lazy_mag._result is None and lazy_mag._t0 == lazy_mag.compute()._t0
+
+def test_filter_cache():
+    """Repeated filter designs should come from the shared cache"""
+    sampled.filter_cache.clear()
+    x = sampled.Data(np.random.randn(2000), sr=500)
+    for _ in range(3):
+        x.lowpass(10)
+        x.bandpass(5, 50)
+    info = sampled.filter_cache.info()
+    assert (info['hits'], info['misses'], info['size']) == (4, 2, 2)
+    sos = sampled.filter_cache.butter(6, 10., 500., 'low')
+    assert sos.shape == (3, 6)
+    sos[:] = 0.
+    assert np.any(sampled.filter_cache.butter(6, 10., 500., 'low'))
+    sampled.filter_cache.maxsize = 2
+    sampled.filter_cache.butter(4, 10., 500., 'low')
+    assert sampled.filter_cache.info()['size'] == 2
+    sampled.filter_cache.maxsize = 128
+
+def test_butterfilt_sos():
+    """float32 signals stay float32, and NaN gaps are left in place while the finite stretches are filtered"""
+    x = np.random.randn(2000, 2).astype(np.float32)
+    x[500:520, 1] = np.nan
+    y = sampled.Data(x, sr=180).lowpass(10)
+    assert y().dtype == np.float32
+    assert np.array_equal(np.isnan(y()), np.isnan(x))
+    assert y._history[-1][1]['NaN manipulation']
+    y_first = sampled.Data(x[:500, 1], sr=180).lowpass(10)
+    assert np.allclose(y()[:500, 1], y_first(), atol=1e-5)
+
+def test_chunked():
+    """Block-wise processing should match processing the whole signal in memory"""
+    import tempfile
+    x = sampled.Data(np.random.randn(20000, 2), sr=1000)
+    with tempfile.TemporaryDirectory() as out_dir:
+        ch = x.chunked(chunk_size=3000, out_dir=out_dir)
+        assert np.allclose(ch.bandpass(20, 200)(), x.bandpass(20, 200)())
+        assert np.allclose(ch.lowpass(5.)(), x.lowpass(5.)(), atol=1e-8)
+        assert np.allclose(ch.medfilt(21)(), x.medfilt(21)())
+        assert np.allclose(ch.diff()(), x.diff()())
+        rms = lambda w, axis: np.sqrt(np.mean(w**2, axis=axis))
+        assert np.allclose(ch.apply_running_win(rms, 0.1, 0.01)(), x.apply_running_win(rms, 0.1, 0.01)())
+        assert len(os.listdir(out_dir)) == 5
+        x2 = sampled.Data(np.random.randn(20000, 2), sr=2000)
+        assert np.allclose(x2.chunked(1000, out_dir).bandpass(20, 450)(), x2.bandpass(20, 450)()) # chunks shorter than the filter
+    first, second = x.chunked(), x.chunked()
+    assert first.out_dir == second.out_dir # one temporary directory per session
+    with x.chunked(chunk_size=3000) as ch:
+        y = ch.lowpass(5.)
+        fname = ch.files[0]
+        assert os.path.exists(fname)
+        del y
+    assert not os.path.exists(fname)
+
+def test_from_file():
+    """Memory-mapped .npy and raw interleaved binary files"""
+    import tempfile
+    x = (np.random.randn(5000, 4)*1000).astype(np.int16)
+    with tempfile.TemporaryDirectory() as out_dir:
+        x.tofile(os.path.join(out_dir, 'acq.bin'))
+        np.save(os.path.join(out_dir, 'acq.npy'), x)
+        for d in (sampled.Data.from_file(os.path.join(out_dir, 'acq.bin'), 1000, np.int16, 4), sampled.Data.from_file(os.path.join(out_dir, 'acq.npy'), 1000)):
+            assert len(d) == 5000 and d.axis == 0
+            assert np.array_equal(d[1.:1.01](), x[1000:1011])
+            assert d[1.:1.01]._t0 == 1.
+
+def test_view_slicing():
+    """Slices are views into the parent signal, and are copied when they are modified"""
+    x = sampled.Data(np.arange(20.), sr=10)
+    y = x[0.5:1.]
+    assert np.shares_memory(y(), x())
+    y[0.5:0.7] = np.nan
+    assert np.isnan(y()[:3]).all() and not np.isnan(x()).any()
+    z = x.shift_left(1.)
+    z[0] = -1.
+    assert x()[0] == 0. and z()[0] == -1.
+    child = x[0:10]
+    x[0:5] = -1. # assigning to the parent doesn't change its views
+    assert np.array_equal(child(), np.arange(10.)) and (x()[:5] == -1.).all()
+    tbl = sampled.EventTable([0], [9], sr=10)
+    seg, = tbl.slice_data(x)
+    x[0:10] = 5.
+    assert np.array_equal(seg()[:5], [-1.]*5)
+
+def test_point_lookup():
+    """Closed-form lookup should match scipy's interp1d"""
+    from scipy.interpolate import interp1d
+    x = sampled.Data(np.random.random((10, 3)), sr=2, t0=5.)
+    t = np.linspace(5, 9.5, 37)
+    assert np.allclose(x[list(t)], interp1d(x.t, x(), axis=0)(t))
+    assert np.allclose(x[-1], x()[-1]) and x[5.05].shape == (3,)
+    x1 = sampled.Data(np.random.random((3, 50)), sr=10, axis=1)
+    assert np.allclose(x1.at([0.12, 2.77], 'nearest'), x1()[:, [1, 28]])
+    cubic = sampled.Data(np.arange(50.)**2, sr=1)
+    assert np.isclose(cubic.at(10.5, 'cubic'), 10.5**2)
+    try:
+        x[2.]
+        assert False
+    except ValueError:
+        pass
+
+def test_running_win():
+    """Built-in reducers and batched callables should match applying a function to each window"""
+    x = np.random.randn(3000, 3)
+    x[100:103, 1] = np.nan
+    d = sampled.Data(x, sr=1000)
+    rw = d.make_running_win(0.05, 0.005)
+    rms = lambda w, axis: np.sqrt(np.mean(w**2, axis=axis))
+    for reducer, func in (('mean', np.mean), ('rms', rms), ('var', np.var), ('min', np.min), ('max', np.max)):
+        expected = np.array([func(x[win], 0) for win in rw()])
+        assert np.allclose(d.apply_running_win(reducer, 0.05, 0.005)(), expected, equal_nan=True)
+        assert np.allclose(d.apply_running_win(func, 0.05, 0.005)(), expected, equal_nan=True)
+    d1 = sampled.Data(x.T, sr=1000, axis=1).apply_running_win('count_above', 0.05, 0.005, threshold=1.)
+    assert d1().shape == (3, len(rw)) and d1().max() <= 51
+
+def test_medfilt():
+    """Running median should match the median of each window, on either axis"""
+    x = np.random.randn(2000, 3)
+    x[100, 1] = np.nan
+    windows = np.lib.stride_tricks.sliding_window_view(x, 51, axis=0)
+    expected = np.concatenate((x[:25], np.median(windows, axis=-1), x[-25:]))
+    assert np.allclose(sampled.Data(x, sr=1000).medfilt(51)(), expected, equal_nan=True)
+    assert np.allclose(sampled.Data(x.T, sr=1000, axis=1).medfilt(0.05)().T, expected, equal_nan=True)
+    assert np.isfinite(sampled.Data(x[:, 0], sr=1000).medfilt(51, mode='nearest')()).all()
+
+def test_analytic():
+    """Envelope, phase and frequency are derived from one cached analytic signal"""
+    from scipy.signal import hilbert
+    x = np.random.randn(4096, 2)
+    assert np.allclose(sampled.analytic_signal(x, axis=0), hilbert(x, axis=0))
+    for n_samples in (3001, 2999):
+        x = np.random.randn(n_samples, 2)
+        assert np.allclose(sampled.analytic_signal(x, axis=0), hilbert(x, axis=0))
+    d = sampled.Data(np.sin(2*np.pi*10*np.arange(3000)/1000.), sr=1000)
+    env = d.envelope(lowpass=False)
+    assert d._analytic_cache is not None
+    assert np.allclose(env()[500:-500], 1., atol=1e-2)
+    assert np.allclose(d.envelope('lower', lowpass=False)(), -env())
+    assert np.allclose(d.instantaneous_frequency()()[500:-500], 10., atol=0.1)
+    a = d.analytic()
+    a[0:100] = 0. # doesn't change the cached analytic signal
+    assert np.allclose(d.envelope(lowpass=False)(), env())
+    d()[:] = 0. # in-place change of the samples invalidates the cache
+    assert np.allclose(d.envelope(lowpass=False)(), 0.)
+    x = np.random.randn(3001)
+    unpadded = sampled.Data(x, sr=1000)
+    unpadded_env = unpadded.envelope(lowpass=False)()
+    sampled.FFT_PAD_FAST_LEN = True
+    try:
+        assert np.allclose(unpadded.envelope(lowpass=False)(), np.abs(sampled.analytic_signal(x, pad_fast_len=True)))
+    finally:
+        sampled.FFT_PAD_FAST_LEN = False
+    assert np.allclose(unpadded.envelope(lowpass=False)(), unpadded_env)
+
+def test_spectral():
+    """Welch PSD and spectrogram should match scipy.signal, batch size should not matter"""
+    from scipy import signal
+    x = np.random.randn(6000, 2)
+    d = sampled.Data(x, sr=1000, t0=2.)
+    f, pxx = d.psd(batch_size=5)
+    assert np.allclose(pxx, signal.welch(x, fs=1000, axis=0)[1]) and len(f) == pxx.shape[0]
+    f, t, sxx = d.spectrogram()
+    _, t_ref, sxx_ref = signal.spectrogram(x.T, fs=1000)
+    assert np.allclose(t, t_ref + 2.) and np.allclose(sxx, sxx_ref)
+    f, pxx = sampled.Data(x[:, 0], sr=1000).multitaper(NW=3)
+    assert np.isclose(pxx.mean(), 2./1000, rtol=0.05) # white noise with unit variance
+
+def test_stream_processor():
+    """Processing blocks of any size should give the same output as processing the whole signal"""
+    x = np.random.randn(5000, 2)
+    sp = sampled.StreamProcessor([('bandpass', 20, 450), ('envelope', None)], sr=2000)
+    full = sp(x)()
+    sp.reset()
+    blocks = [sp(x[start:start+n]) for start, n in zip(range(0, 5000, 613), [613]*9)]
+    assert np.allclose(np.concatenate([b() for b in blocks]), full)
+    assert np.isclose(blocks[2]._t0, 2*613/2000.)
+    assert len(sp.latency) == 9
+
+def test_parallel():
+    """Thread and process pools should give the same result and history as the serial path"""
+    from scipy.signal import detrend
+    x = np.random.randn(3000, 6)
+    x[100:110, 2] = np.nan
+    d = sampled.Data(x, sr=1000)
+    filled = d.interpnan()
+    detrended = filled.apply(detrend)
+    for backend in ('thread', 'process'):
+        with sampled.parallel(3, backend):
+            assert np.allclose(d.interpnan()(), filled(), equal_nan=True)
+            par_detrended = filled.apply(detrend)
+            assert np.allclose(par_detrended(), detrended())
+            assert par_detrended._history[-1][1]['kwargs'] == detrended._history[-1][1]['kwargs']
+            y = sampled.Data(filled().T, sr=1000, axis=1)
+            assert np.allclose(y.apply(np.mean)(), filled().mean(axis=0)) # reduces the time axis
+            assert np.allclose(y.apply(np.sum, keepdims=True)(), filled().sum(axis=0)[:, None])
+            assert np.allclose(y.apply(np.ravel)(), filled().T.ravel()) # channels don't match the output, serial fallback
+    assert sampled.PARALLEL['n_workers'] == 1
+
+def test_interpnan_nd():
+    """Vectorized NaN interpolation should match per-channel interp1d"""
+    from scipy.interpolate import interp1d
+    x = np.random.randn(500, 4)
+    x[:5, 0] = np.nan
+    x[50:52, 1] = np.nan
+    x[60:70, 1] = np.nan
+    x[-3:, 2] = np.nan
+    d = sampled.Data(x, sr=100)
+    for kind in ('linear', 'nearest'):
+        ret = d.interpnan(kind=kind)()
+        for ch in range(4):
+            valid = ~np.isnan(x[:, ch])
+            ref = interp1d(np.flatnonzero(valid), x[valid, ch], kind=kind, fill_value='extrapolate')(np.arange(500))
+            assert np.allclose(ret[:, ch], ref)
+    ret = d.interpnan(maxgap=3)()
+    assert not np.isnan(ret[50:52, 1]).any() and np.isnan(ret[60:70, 1]).all() and np.isnan(ret[:5, 0]).all()
+    assert np.allclose(sampled.Data(x.T, sr=100, axis=1).interpnan(maxgap=3)(), ret.T, equal_nan=True)
+    assert np.allclose(sampled.interpnan(np.array([1., np.nan, 3., np.nan]), 1), [1., 2., 3., 4.])
+
+def test_onoff():
+    """Onsets/offsets of 1D, 2D and bit-packed boolean signals"""
+    x = np.array([1, 1, 0, 0, 1, 0, 1, 1, 1], dtype=bool)
+    onsets, offsets = sampled.onoff_samples(x)
+    assert list(onsets) == [0, 4, 6] and list(offsets) == [2, 5, 8]
+    onsets, offsets = sampled.onoff_samples(np.packbits(x), n_samples=len(x))
+    assert list(onsets) == [0, 4, 6] and list(offsets) == [2, 5, 8]
+    X = np.vstack((x, ~x)).T
+    onsets, offsets = sampled.onoff_samples(X, axis=0)
+    assert list(onsets[1]) == [2, 5] and list(offsets[1]) == [4, 6]
+    on_times, off_times = sampled.Data(X, sr=10, t0=1.).onoff_times()
+    assert np.allclose(on_times[0], [1., 1.4, 1.6]) and np.allclose(off_times[1], [1.4, 1.6])
+
+def test_provenance():
+    """History should not keep large arrays alive, and should be serializable"""
+    import json
+    x = sampled.Data(np.random.randn(1000, 2), sr=100)
+    offset = np.ones((1000, 2))
+    y = x.shift_baseline(offset).apply(np.cumsum, axis=0)[1.:2.]
+    ref = y._history[1][1]
+    assert isinstance(ref, sampled.ArrayRef) and ref.shape == (1000, 2)
+    assert ref.digest == sampled.array_digest(offset) and sampled.provenance.lookup(ref.digest) is ref
+    assert y._history[2][1]['func'] == 'numpy.cumsum'
+    assert y._history[3] == ('slice', ('Interval', 1., 2., 100.))
+    assert json.loads(sampled.provenance.dumps(y._history))[1][1]['ArrayRef']['shape'] == [1000, 2]
+    assert x.shift_baseline(np.ones(2))._history[-1][1].shape == (2,) # small arrays are kept
+    assert x.bandpass(1, 10).envelope()._history[-1][1]['cutoff'] == 1
+
+def test_result_cache():
+    """Cached results should match computed results, and the cache should stay within its size limit"""
+    import tempfile
+    x = sampled.Data(np.random.randn(20000, 2), sr=1000)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        sampled.result_cache.enable(cache_dir, max_bytes=1e6)
+        try:
+            y = x.bandpass(1, 10)
+            y_cached = x.bandpass(1, 10, order=None)
+            assert sampled.result_cache.hits == 1
+            assert np.array_equal(y(), y_cached()) and y_cached._history == y._history
+            y_cached[0:10] = 0. # copy on write
+            assert not np.allclose(x.bandpass(1, 10)()[:10], 0.)
+            assert x.resample(500).sr == 500 and x.resample(500).sr == 500
+            n_files = len(os.listdir(cache_dir))
+            x.chunked(5000).bandpass(1, 10)
+            assert len(os.listdir(cache_dir)) == n_files # blocks are not cached
+            assert not np.allclose(x.resample(500, method='fft', window=lambda f: np.ones(len(f)))(), x.resample(500, method='fft', window=lambda f: np.exp(-f**2))())
+            assert len(os.listdir(cache_dir)) == n_files # callable parameters are not cached
+            x()[:] = 0. # in-place changes are not served from the cache
+            assert np.allclose(x.bandpass(1, 10)(), 0.)
+            for order in (3, 5, 7):
+                x.medfilt(order)
+            assert sampled.result_cache.info()['bytes'] <= 1e6
+        finally:
+            sampled.result_cache.clear()
+            sampled.result_cache.disable()
+
+def test_resample():
+    """Polyphase resampling for rational ratios, and the same result when streamed in blocks"""
+    x = sampled.Data(np.random.randn(20001, 2), sr=2000, t0=1.)
+    assert sampled.rational_ratio(180, 2000) == (9, 100)
+    y = x.resample(180)
+    assert y._history[-1][1]['method'] == 'poly' and len(y) == 1801 and y._t0 == 1.
+    assert np.allclose(x.chunked(chunk_size=1000).resample(180)(), y())
+    assert len(x.resample(180, method='fft')) == 1800
+    assert x.resample(np.pi)._history[-1][1]['method'] == 'fft'
+
+def test_uniform_resample():
+    """Multi-channel resampling of jittered timestamps with a reusable plan"""
+    t = np.cumsum(0.005 + 0.002*np.random.rand(500))
+    x = np.random.randn(500, 3)
+    y = sampled.uniform_resample(t, x, 200)
+    assert y._t0 == t[0] and y().shape[1] == 3
+    assert np.allclose(y()[:, 1], np.interp(t[0] + np.arange(len(y))/200, t, x[:, 1]))
+    assert np.allclose(sampled.uniform_resample(t, x.T, 200)(), y().T)
+    plan = sampled.ResamplePlan(t, 200, kind='cubic')
+    assert np.allclose(plan(x)()[:, 2], plan(x[:, 2])())
+    assert np.allclose(plan(t)(), t[0] + np.arange(len(plan))/200) # cubic is exact for linear signals
+    nearest = sampled.ResamplePlan(t, 200, kind='nearest')(x)()
+    assert np.all(np.isin(nearest[:, 0], x[:, 0]))
+
+def test_time_axis():
+    """Lazy time axis should behave like the time vector"""
+    x = sampled.Data(np.random.randn(1000, 2), sr=100, t0=0.37)
+    t = x.time_axis
+    t_arr = 0.37 + np.arange(1000)/100
+    assert isinstance(x.t, np.ndarray) and np.allclose(x.t, t_arr)
+    assert isinstance(t, sampled.TimeAxis) and len(t) == 1000
+    assert np.allclose(np.asarray(t), t_arr) and t[-1] == t_arr[-1]
+    assert np.allclose(np.asarray(t[10:20]), t_arr[10:20]) and t[10:20][0] == x[10:20].time_axis[0]
+    assert np.allclose(t[::-1], t_arr[::-1]) and np.allclose(t[[1, 5]], t_arr[[1, 5]])
+    v = np.r_[-1., t_arr[0], t_arr[500], t_arr[500] + 1e-9, 100.]
+    assert np.array_equal(t.searchsorted(v), np.searchsorted(t_arr, v))
+    assert np.array_equal(t.searchsorted(v, side='right'), np.searchsorted(t_arr, v, side='right'))
+    assert isinstance(t - 0.37, sampled.TimeAxis) and np.allclose(t*2, t_arr*2) and (t > 5).sum() == (t_arr > 5).sum()
+
+def test_interval_frames():
+    """Closed form time vectors, and re-entrant iteration over interval frames"""
+    intvl = sampled.Interval(0., 0.3, sr=10)
+    assert len(intvl.t) == len(intvl) == 4 # end sample is not lost to floating point error
+    intvl = sampled.Interval(1.3, 4.7, sr=180, iter_rate=24)
+    nearest_sample, time, index = intvl.frames()
+    frames = list(intvl)
+    assert frames == list(zip(nearest_sample.tolist(), time.tolist(), index.tolist()))
+    assert frames[0] == (intvl.start.sample, 1.3, 0) and len(frames) == int(intvl.dur_time*24) + 2
+    assert sum(1 for _ in intvl for _ in intvl) == len(frames)**2 # nested loops don't interfere
+    assert next(intvl) == frames[0] # __next__ is still available
+
+def test_time_array():
+    """Vectorized time conversions should match Time"""
+    times = np.random.rand(1000)*3600
+    ta = sampled.TimeArray(times, 30).change_sr(180.).change_sr(2000.)
+    ts = [sampled.Time(float(x), 30).change_sr(180.).change_sr(2000.) for x in times]
+    assert np.array_equal(ta.sample, [t.sample for t in ts]) and np.array_equal(ta.time, [t.time for t in ts])
+    assert ta[5].sample == ts[5].sample and ta[5].time == ts[5].time
+    x = sampled.TimeArray([100, 200], 180)
+    assert list((x + 10).sample) == [110, 210] and list((x + 0.5).sample) == [(sampled.Time(100, 180) + 0.5).sample, 290]
+    assert list((x - x).sample) == [0, 0]
+    timecodes = ['00;09;53;29', '00;10;00;02']
+    assert list(sampled.TimeArray(timecodes, 30).sample) == [sampled.Time(tc, 30).sample for tc in timecodes]
+    drop_frame = sampled.TimeArray.from_timecode(['00;01;00;02', '00;10;00;00'], 29.97, drop_frame=True)
+    assert list(drop_frame.sample) == [1800, 17982]
+    frames = sampled.TimeArray(np.arange(40000), 29.97)
+    assert np.array_equal(sampled.TimeArray.from_timecode(frames.to_timecode(drop_frame=True), 29.97, drop_frame=True).sample, frames.sample)
+
+def test_event_table():
+    """Label queries, round trip with Events, and bulk slicing"""
+    events = sampled.Events()
+    events.append(sampled.Event(1., 2., sr=100, labels=['pitch', 'fastball']))
+    events.append(sampled.Event(3., 4., sr=100, labels=['pitch']))
+    events.append(sampled.Event(5., 6., sr=100, labels=['warmup']))
+    events.append(sampled.Interval(7., 8., sr=100))
+    assert events[0].labels == ['pitch', 'fastball'] # append keeps labels
+    tbl = events.to_table()
+    assert list(tbl.rows('pitch')) == [0, 1] and list(tbl.rows('pitch', 'fastball')) == [0]
+    assert list(tbl.rows('fastball', 'warmup', how='or')) == [0, 2] and len(tbl.get('curveball')) == 0
+    assert list(tbl.get('pitch').get('fastball').start) == [100]
+    back = tbl.to_events()
+    assert [(e.start.sample, e.end.sample, e.labels) for e in back] == [(e.start.sample, e.end.sample, e.labels) for e in events]
+    x = sampled.Data(np.random.randn(1000, 2), sr=100)
+    segments = tbl.get('pitch').slice_data(x)
+    assert all(np.array_equal(seg(), x.take_by_interval(ev)()) and seg._t0 == x.take_by_interval(ev)._t0 for seg, ev in zip(segments, events))
+    stacked = tbl.stack(x)
+    assert stacked.shape == (4, 101, 2) and np.array_equal(stacked[2], x.take_by_interval(events[2])())
+
+def test_interval_index():
+    """Tree queries should match brute force, including intervals appended after the index was built"""
+    start = np.random.randint(0, 100000, 2000)
+    end = start + np.random.randint(0, 300, 2000)
+    idx = sampled.IntervalIndex(start[:1000], end[:1000])
+    for s, e in zip(start[1000:], end[1000:]):
+        idx.append(s, e)
+    for a in np.random.randint(0, 100000, 50):
+        b = a + 500
+        assert np.array_equal(idx.overlap(a, b), np.flatnonzero((start <= b) & (end >= a)))
+        assert np.array_equal(idx.stab(a), np.flatnonzero((start <= a) & (end >= a)))
+        assert np.array_equal(idx.containing(a, a+50), np.flatnonzero((start <= a) & (end >= a+50)))
+        assert np.array_equal(idx.within(a, b), np.flatnonzero((start >= a) & (end <= b)))
+    q, rows = idx.overlap_pairs([10, 50000], [20, 50100])
+    assert np.array_equal(rows[q == 1], idx.overlap(50000, 50100))
+    merged_start, merged_end = sampled.IntervalIndex([0, 3, 10, 12, 21], [5, 4, 13, 20, 22]).merge()
+    assert list(merged_start) == [0, 10, 21] and list(merged_end) == [5, 20, 22] # adjacent intervals are not merged
+    events = sampled.Events([sampled.Event(sampled.Time(s, 10.), sampled.Time(s+14, 10.)) for s in range(0, 100, 10)])
+    assert [e.start.sample for e in events.overlapping(31, 45)] == [20, 30, 40]
+    events.append(sampled.Event(sampled.Time(200, 10.), sampled.Time(210, 10.), labels=['late']))
+    assert events.overlapping(20.5)[0].labels == ['late'] # index is updated on append
+    assert events.index(events[3]) == 3 # list.index is not shadowed
+    events.remove(events[-1])
+    events.insert(0, sampled.Event(sampled.Time(500, 10.), sampled.Time(510, 10.)))
+    assert events.overlapping(20.5) == [] and events.overlapping(50.5)[0].start.sample == 500
+
+def test_interval_setop():
+    """Set operations on intervals should match set operations on the covered samples"""
+    def covered(start, end):
+        ret = np.zeros(2200, dtype=bool)
+        for s, e in zip(start, end):
+            ret[max(s, 0):e+1] = True
+        return ret
+    a_start = np.random.randint(100, 2000, 50)
+    a = (a_start, a_start + np.random.randint(0, 40, 50))
+    b_start = np.random.randint(100, 2000, 50)
+    b = (b_start, b_start + np.random.randint(0, 40, 50))
+    in_a, in_b = covered(*a), covered(*b)
+    for how, expected in (('union', in_a | in_b), ('intersection', in_a & in_b), ('difference', in_a & ~in_b), ('symmetric_difference', in_a ^ in_b)):
+        start, end = sampled.interval_setop(*a, *b, how=how)
+        assert np.array_equal(covered(start, end), expected) and np.all(start[1:] > end[:-1] + 1)
+    assert np.array_equal(covered(*sampled.interval_complement(*a, 0, 2199)), ~in_a)
+    assert np.array_equal(covered(*sampled.interval_dilate(*a, 3)), np.convolve(in_a, np.ones(7), 'same') > 0)
+    assert np.array_equal(covered(*sampled.interval_dilate(*a, -3)), np.convolve(~in_a, np.ones(7), 'same') == 0)
+    movement = sampled.Events([sampled.Interval(sampled.Time(0, 100.), sampled.Time(1000, 100.))])
+    artifacts = sampled.Events([sampled.Event(sampled.Time(100, 100.), sampled.Time(200, 100.)), sampled.Event(sampled.Time(500, 100.), sampled.Time(520, 100.))])
+    assert [(e.start.sample, e.end.sample) for e in movement.difference(artifacts)] == [(0, 99), (201, 499), (521, 1000)]
+    assert [(e.start.sample, e.end.sample) for e in artifacts.complement(sampled.Interval(0., 10., sr=100.))] == [(0, 99), (201, 499), (521, 1000)]
+    assert [(e.start.sample, e.end.sample) for e in artifacts.dilate(1.)] == [(0, 300), (400, 620)]
+    assert [(e.start.sample, e.end.sample) for e in artifacts.erode(15)] == [(115, 185)]
+
 if __name__ == '__main__':
     pn.TimeIt(testTracker)()
     pn.TimeIt(testTrackerQuery)()